@@ -0,0 +1,73 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+
+from backend.metrics import observe
+
+
+class Overloaded(Exception):
+    """Work was shed instead of queued because a service is saturated."""
+
+
+class Limiter:
+    """Caps concurrent requests to one upstream service.
+
+    Up to ``limit`` requests run at once and up to ``max_waiting`` more wait
+    for a slot, each for at most ``max_wait`` seconds. Anything beyond that
+    is shed with Overloaded straight away, so a spike fails fast for the
+    excess instead of making every caller slow. ``limit=0`` disables the cap.
+    """
+
+    def __init__(self, name, limit, max_waiting=0, max_wait=None):
+        self.name = name
+        self.limit = limit
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait
+        self._semaphore = asyncio.Semaphore(limit) if limit else None
+
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+
+    async def _acquire(self):
+        if self._semaphore is None:
+            return
+        if self._semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Overloaded(f"{self.name} is at capacity ({self.limit} running, {self.waiting} waiting)")
+
+        wait_start = time.monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.max_wait)
+        except asyncio.TimeoutError:
+            self.timed_out += 1
+            raise Overloaded(f"{self.name} had no free slot within {self.max_wait}s") from None
+        finally:
+            self.waiting -= 1
+        observe(f"{self.name}_wait", time.monotonic() - wait_start)
+
+    @asynccontextmanager
+    async def slot(self):
+        await self._acquire()
+        self.active += 1
+        self.admitted += 1
+        try:
+            yield
+        finally:
+            self.active -= 1
+            if self._semaphore is not None:
+                self._semaphore.release()
+
+    def stats(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "timed_out": self.timed_out,
+            "shed": self.rejected + self.timed_out,
+        }
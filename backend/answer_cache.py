@@ -0,0 +1,66 @@
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+
+_PUNCTUATION = re.compile(r'[^\w\s]')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_query(text):
+    text = unicodedata.normalize('NFC', text).casefold()
+    text = _PUNCTUATION.sub(' ', text)
+    return _WHITESPACE.sub(' ', text).strip()
+
+
+class AnswerCache:
+    """LRU cache of segmented LLM answers keyed by normalized query.
+
+    Entries expire ``ttl`` seconds after they were stored; at most
+    ``max_entries`` are kept.
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.expirations = 0
+        self.evictions = 0
+
+    def get(self, query):
+        key = normalize_query(query)
+        entry = self._entries.get(key)
+        if entry is not None:
+            stored_at, sentences = entry
+            if time.monotonic() - stored_at < self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return sentences
+            del self._entries[key]
+            self.expirations += 1
+        self.misses += 1
+        return None
+
+    def put(self, query, sentences):
+        if self.max_entries <= 0 or not sentences:
+            return
+        key = normalize_query(query)
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic(), tuple(sentences))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
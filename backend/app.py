@@ -1,16 +1,26 @@
 import asyncio
+import os
 import logging
 import re
-import requests
 import json
+import time
+from contextlib import aclosing
+import requests
 import uvicorn
 from fastapi.staticfiles import StaticFiles
 from fastapi import FastAPI, Query, WebSocket, WebSocketDisconnect
-from fastapi.responses import StreamingResponse
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
 
+from backend.admission import Overloaded
 from backend.tts import text_to_speech_stream
 from backend.client import ASRClient
+from backend.metrics import REGISTRY, new_session_id, observe
+from backend.outbound import AUDIO, PARTIAL, OutboundQueue, counters as outbound_counters
+from backend.pipeline import ResponsePipeline
+from backend.protocol import pack_tts_audio, pack_tts_chunk
+from backend.speculation import SPECULATION, Speculator
+from backend.synth import get_tts_backend
 
 logging.basicConfig(
     level=logging.INFO,
@@ -32,7 +42,42 @@ app.add_middleware(
 app.mount("/frontend", StaticFiles(directory="frontend", html=True), name="frontend")
 
 
+ASR_SERVER_URL = os.getenv('ASR_SERVER_URL', 'ws://localhost:5000')
+# Browser sessions beyond this are turned away; 0 disables the cap.
+APP_MAX_SESSIONS = int(os.getenv('APP_MAX_SESSIONS', '200'))
+
+# Close code asking the client to reconnect later (RFC 6455 "Try Again Later").
+WS_TRY_AGAIN_LATER = 1013
+BUSY_MESSAGE = "Server is busy, please try again shortly"
+
 active_asr_clients = {}
+active_pipelines = {}
+active_outbound = {}
+sessions_rejected = 0
+
+REGISTRY.gauge('app_active_sessions', 'Connected browser sessions.', lambda: len(active_asr_clients))
+REGISTRY.gauge('app_sessions_rejected', 'Browser sessions turned away at capacity.', lambda: sessions_rejected)
+REGISTRY.gauge(
+    'app_active_responses',
+    'Responses currently being generated.',
+    lambda: sum(pipeline.active for pipeline in active_pipelines.values())
+)
+REGISTRY.gauge(
+    'app_asr_pending_bytes',
+    'Microphone audio not yet written to the ASR gateway connections.',
+    lambda: sum(client.pending_audio_bytes() for client in active_asr_clients.values())
+)
+REGISTRY.gauge(
+    'app_outbound_queued_bytes',
+    'Bytes waiting to be sent to browsers.',
+    lambda: sum(outbound.queued_bytes for outbound in active_outbound.values())
+)
+REGISTRY.stats_gauges('app_outbound', 'Messages sent to browsers', outbound_counters.stats)
+
+@app.get("/metrics")
+def metrics():
+    """Stage latency histograms and load gauges in Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/response")
 def receive_response(query: str = Query(...)):
@@ -43,99 +88,220 @@ def receive_response(query: str = Query(...)):
 
 
 @app.websocket("/asr-tts-full-pipeline")
-async def asr_tts_full_pipeline(websocket: WebSocket):
-    """WebSocket endpoint for complete end-to-end ASR → Process → TTS pipeline"""
+async def asr_tts_full_pipeline(websocket: WebSocket, codec: str = Query('pcm'), stream_audio: bool = Query(False)):
+    """WebSocket endpoint for complete end-to-end ASR → Process → TTS pipeline
+
+    The browser streams its microphone as binary frames, which are forwarded
+    to the ASR gateway over this session's own connection, and receives
+    transcripts, responses and TTS audio back. Frames are 16 kHz mono PCM,
+    or one packet each of the ``codec`` asked for with ``?codec=``; the
+    ready message says which one the gateway accepted. With
+    ``?stream_audio=1`` TTS audio is forwarded chunk by chunk as it is
+    synthesized instead of once per sentence.
+
+    Everything sent back goes through the session's OutboundQueue, so a
+    slow browser falls behind in its own buffer instead of holding up its
+    response: control messages go first, audio next and partial transcripts
+    last, and audio of an interrupted response is never sent. A client too
+    far behind has the rest of the response's audio skipped and is sent an
+    interrupt, so it can flush what it has.
+    """
+    global sessions_rejected
+
     await websocket.accept()
     client_id = id(websocket)
+    if APP_MAX_SESSIONS and len(active_asr_clients) >= APP_MAX_SESSIONS:
+        sessions_rejected += 1
+        logger.warning(f"Turning away client {client_id}, at capacity ({len(active_asr_clients)} sessions)")
+        await websocket.send_json({"type": "error", "data": BUSY_MESSAGE})
+        await websocket.close(code=WS_TRY_AGAIN_LATER)
+        return
+    session_id = new_session_id()
     
-    logger.info(f"WebSocket connection established for client {client_id}")
+    logger.info(f"WebSocket connection established for client {client_id} (session {session_id})")
     
-    asr_client = ASRClient('ws://localhost:5000')
+    asr_client = ASRClient(ASR_SERVER_URL, session_id=session_id, codec=codec)
     active_asr_clients[client_id] = asr_client
+    outbound = OutboundQueue(
+        websocket.send_text,
+        websocket.send_bytes,
+        skip_message={"type": "interrupt", "data": "connection too slow, audio skipped"}
+    )
+    active_outbound[client_id] = outbound
+    outbound.start()
+
+    async def send_control(message):
+        if message["type"] == "interrupt":
+            outbound.discard(AUDIO)
+        outbound.send_json(message)
+
+    pipeline = ResponsePipeline(send_control)
+    active_pipelines[client_id] = pipeline
+    speculator = Speculator(SPECULATION) if SPECULATION != 'off' else None
     
-    async def process_transcription_and_generate_tts(text):
+    async def process_transcription_and_generate_tts(text, speculation=None):
         if not text:
             return
+        response_start = time.perf_counter()
+        outbound.resume_audio()
             
-        await websocket.send_json({
+        outbound.send_json({
             "type": "transcription",
             "data": text
         })
         
         processed_text = receive_response(query=text)
         
-        await websocket.send_json({
+        outbound.send_json({
             "type": "response",
             "data": processed_text
         })
         
-        await websocket.send_json({
+        outbound.send_json({
             "type": "tts_starting",
             "data": "Starting TTS audio stream"
         })
         
         try:
-            tts_stream = text_to_speech_stream(processed_text)
-            
-            async for chunk in tts_stream:
-                if not chunk:
-                    continue
-                    
-                event_lines = chunk.split('\n')
-                data_line = next((line for line in event_lines if line.startswith('data: ')), None)
-                
-                if data_line:
-                    json_data = json.loads(data_line[6:]) 
-                    
-                    await websocket.send_json({
-                        "type": "tts_update",
-                        "data": json_data
-                    })
+            # aclosing makes a cancelled response close the TTS stream, which
+            # in turn cancels its pending syntheses and the LLM request.
+            if speculation is not None:
+                tts_stream = text_to_speech_stream(
+                    processed_text,
+                    sentences=speculation.sentences(),
+                    prefetched=speculation.audio,
+                    stream_chunks=stream_audio
+                )
+            else:
+                tts_stream = text_to_speech_stream(processed_text, stream_chunks=stream_audio)
+            async with aclosing(tts_stream) as tts_stream:
+                async for update in tts_stream:
+                    if update.seq == 0 and update.part == 0:
+                        observe('response_first_audio', time.perf_counter() - response_start)
+                    if stream_audio:
+                        frame = pack_tts_chunk(
+                            update.seq, update.part, update.final, update.text, update.duration, update.audio
+                        )
+                    else:
+                        frame = pack_tts_audio(update.seq, update.text, update.duration, update.audio)
+                    outbound.send_bytes(frame)
             
-            await websocket.send_json({
+            # Sent behind the audio it completes.
+            outbound.send_json({
                 "type": "tts_complete",
                 "data": "TTS audio stream complete"
-            })
+            }, AUDIO)
             
+        except Overloaded as e:
+            logger.warning(f"Dropped response for client {client_id}: {e}")
+            outbound.send_json({
+                "type": "error",
+                "data": BUSY_MESSAGE
+            })
         except Exception as e:
             logger.error(f"Error generating TTS: {e}")
-            await websocket.send_json({
+            outbound.send_json({
                 "type": "error",
                 "data": f"TTS generation error: {str(e)}"
             })
+        finally:
+            if speculation is not None:
+                speculation.cancel()
+
+    async def handle_final_transcription(text):
+        if not text:
+            return
+        # Partials still queued are older than this final and would overwrite it.
+        outbound.discard(PARTIAL)
+        speculation = speculator.take(text) if speculator else None
+        await pipeline.start(process_transcription_and_generate_tts, text, speculation)
+
+    def handle_partial(text, trailing_silence):
+        # Only the newest partial is worth showing, so queued ones are replaced.
+        outbound.send_partial({"type": "partial", "data": text})
+        if speculator:
+            speculator.on_partial(text, trailing_silence)
+
+    async def receive_client_messages():
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+
+            # Binary frames are microphone audio, passed through in the negotiated codec.
+            if message.get("bytes"):
+                await asr_client.send_audio(message["bytes"])
+                continue
+
+            if not message.get("text"):
+                continue
+            try:
+                control = json.loads(message["text"])
+            except json.JSONDecodeError:
+                logger.warning(f"Ignoring malformed message from client {client_id}")
+                continue
+
+            if control.get("type") == "interrupt":
+                await pipeline.interrupt("client request")
         
     try:
-        if not await asr_client.connect():
-            await websocket.send_json({
+        connected = await asr_client.connect()
+        if not connected and asr_client.rejected_status == 415:
+            # The gateway refuses codecs it cannot decode; PCM always works.
+            logger.warning(f"ASR server refused codec {asr_client.codec}, falling back to PCM for client {client_id}")
+            asr_client.codec = 'pcm'
+            connected = await asr_client.connect()
+        if not connected and asr_client.rejected_status == 503:
+            sessions_rejected += 1
+            outbound.send_json({"type": "error", "data": BUSY_MESSAGE})
+            await outbound.close()
+            await websocket.close(code=WS_TRY_AGAIN_LATER)
+            return
+        if not connected:
+            outbound.send_json({
                 "type": "error",
                 "data": "Failed to connect to ASR server"
             })
             return
             
-        asr_client.set_transcription_callback(process_transcription_and_generate_tts)
+        asr_client.set_transcription_callback(handle_final_transcription)
+        asr_client.set_partial_callback(handle_partial)
         
-        await asr_client.start_streaming()
-        
-        await websocket.send_json({
+        outbound.send_json({
             "type": "status",
-            "data": "ready"
+            "data": "ready",
+            "codec": asr_client.codec,
+            "audio_format": get_tts_backend().mime_type,
+            "stream_audio": stream_audio
         })
         
-        await asr_client.listen_continuously()
+        listener = asyncio.create_task(asr_client.listen_continuously())
+        receiver = asyncio.create_task(receive_client_messages())
+        try:
+            done, _ = await asyncio.wait({listener, receiver}, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            listener.cancel()
+            receiver.cancel()
             
     except WebSocketDisconnect:
         logger.info(f"WebSocket disconnected for client {client_id}")
     except Exception as e:
         logger.error(f"Error in ASR-TTS pipeline: {e}")
-        try:
-            await websocket.send_json({
-                "type": "error",
-                "data": str(e)
-            })
-        except:
-            pass
+        outbound.send_json({
+            "type": "error",
+            "data": str(e)
+        })
     finally:
         # Clean up
+        await pipeline.close()
+        active_pipelines.pop(client_id, None)
+        await outbound.close()
+        active_outbound.pop(client_id, None)
+        logger.info(f"Outbound for client {client_id}: {outbound.stats()}")
+        if speculator:
+            speculator.close()
         if client_id in active_asr_clients:
             await asr_client.stop_streaming()
             await asr_client.disconnect()
@@ -1,11 +1,28 @@
 import asyncio
+import os
 import websockets
 import webrtcvad
 import json
-import struct
 import logging
+import re
+import signal
 import time
-from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from http import HTTPStatus
+from urllib.parse import parse_qs, urlsplit
+
+from backend.asr_pool import ASR_UPSTREAM_URL, ASRConnectionPool, create_wav_header
+from backend.codec import DECODERS, CodecCounters, available_codecs, create_decoder
+from backend.endpoint import (
+    ASR_FINAL_WAIT, ASR_MAX_SILENCE, ASR_MIN_SILENCE, ASR_STABLE_PARTIALS,
+    END, FLUSH, IDLE, SPEECH, START,
+    EndpointCounters, Endpointer
+)
+from backend.metrics import REGISTRY, current_trace, new_session_id, observe, span
+from backend.scheduler import PartialScheduler
+from backend.session import ASRSession
+from backend.transcript import SlidingWindowTranscript
+from backend.vad import EnergyGate
 
 logging.basicConfig(
     level=logging.INFO,
@@ -14,172 +31,331 @@ logging.basicConfig(
 )
 logger = logging.getLogger('asr_server')
 
+ASR_RECOGNITION_MODE = os.getenv('ASR_RECOGNITION_MODE', 'full')
+ASR_WINDOW_SECONDS = float(os.getenv('ASR_WINDOW_SECONDS', '8.0'))
+ASR_WORKERS = int(os.getenv('ASR_WORKERS', '1'))
+ASR_DRAIN_SECONDS = float(os.getenv('ASR_DRAIN_SECONDS', '30'))
+# Admission limits, per worker process; 0 disables one.
+ASR_MAX_SESSIONS = int(os.getenv('ASR_MAX_SESSIONS', '200'))
+ASR_UPSTREAM_CONCURRENCY = int(os.getenv('ASR_UPSTREAM_CONCURRENCY', '0'))
+ASR_MAX_QUEUED_PARTIALS = int(os.getenv('ASR_MAX_QUEUED_PARTIALS', '64'))
+
+_SESSION_ID = re.compile(r'^[\w-]{1,64}$')
+
 class ASRWebSocketServer:
-    def __init__(self, host='0.0.0.0', port=5000):
+    def __init__(self, host='0.0.0.0', port=5000, upstream_url=ASR_UPSTREAM_URL,
+                 upstream_pool_size=4, upstream_max_concurrency=ASR_UPSTREAM_CONCURRENCY or None,
+                 recognition_mode=ASR_RECOGNITION_MODE, window_seconds=ASR_WINDOW_SECONDS,
+                 energy_threshold=100.0, max_utterance_seconds=30.0,
+                 min_silence=ASR_MIN_SILENCE, max_silence=ASR_MAX_SILENCE,
+                 stable_partials=ASR_STABLE_PARTIALS, final_wait=ASR_FINAL_WAIT, max_sessions=ASR_MAX_SESSIONS,
+                 max_queued_partials=ASR_MAX_QUEUED_PARTIALS):
+        if recognition_mode not in ('full', 'incremental'):
+            raise ValueError(f"Unknown recognition mode: {recognition_mode}")
+
         self.host = host
         self.port = port
         self.sample_rate = 16000
         self.frame_duration = 30  
         self.frame_size = int(self.sample_rate * self.frame_duration / 1000)
+        self.frame_bytes = self.frame_size * 2
         self.vad = webrtcvad.Vad(3) 
+        self.energy_gate = EnergyGate(self.frame_size, threshold=energy_threshold)
         self.clients = {}
-        self.executors = {}  
-        self.loops = {}
+        self.server = None
+        self.draining = False
 
-        self.current_transcription = None
-        self.reset_session = False
+        # New sessions beyond max_sessions are refused with 503.
+        self.max_sessions = max_sessions
+        self.sessions_rejected = 0
         
+        # A partial is requested for every processing_interval of audio
+        # received, counted in audio rather than wall-clock time so a burst
+        # of audio can't outrun the ring buffer below.
         self.processing_interval = 1.0
-        self.silence_threshold = 5.0
+        self.process_bytes = int(self.processing_interval * self.sample_rate) * 2
 
-    @staticmethod
-    def create_wav_header(sample_rate, channels, bits_per_sample, data_length):
-        header = bytearray()
-        header.extend(b'RIFF')
-        header.extend(struct.pack('<L', 36 + data_length))
-        header.extend(b'WAVE')
-        header.extend(b'fmt ')
-        header.extend(struct.pack('<L', 16))
-        header.extend(struct.pack('<H', 1))
-        header.extend(struct.pack('<H', channels))
-        header.extend(struct.pack('<L', sample_rate))
-        header.extend(struct.pack('<L', sample_rate * channels * bits_per_sample // 8))
-        header.extend(struct.pack('<H', channels * bits_per_sample // 8))
-        header.extend(struct.pack('<H', bits_per_sample))
-        header.extend(b'data')
-        header.extend(struct.pack('<L', data_length))
-        return bytes(header)
-
-    def convert_buffer_size(self, audio_frame):
-        if len(audio_frame) < self.frame_size * 2:  
-            audio_frame = audio_frame + b'\x00' * (self.frame_size * 2 - len(audio_frame))
-        return audio_frame[:self.frame_size * 2]
-
-    async def process_audio_segment(self, client_id, websocket, audio_data):
-        if not audio_data:
-            return
+        # Defaults for each session's Endpointer; see backend/endpoint.py.
+        self.min_silence = min_silence
+        self.max_silence = max_silence
+        self.stable_partials = stable_partials
+        self.final_wait = final_wait
+        self.endpoint_counters = EndpointCounters()
+        self.codec_counters = CodecCounters()
+
+        # 'full' resends the whole utterance on every partial, 'incremental'
+        # only sends the trailing window of at most window_seconds. Full
+        # mode still commits a prefix once an utterance outgrows
+        # max_utterance_seconds, so long utterances keep their beginning.
+        self.recognition_mode = recognition_mode
+        if recognition_mode == 'full':
+            window_seconds = max_utterance_seconds - 2 * self.processing_interval
+        self.window_seconds = window_seconds
+
+        # Each session preallocates this much audio: the current window plus
+        # the audio that can arrive before the next request commits part of it.
+        retained_seconds = window_seconds + 2 * self.processing_interval
+        self.audio_capacity = int(retained_seconds * self.sample_rate) * 2
 
-        wav_header = self.create_wav_header(self.sample_rate, 1, 16, len(audio_data))
-        wav_data = wav_header + audio_data
+        self.upstream_timeout = 10.0
+        self.upstream_pool = ASRConnectionPool(
+            upstream_url,
+            size=upstream_pool_size,
+            max_concurrency=upstream_max_concurrency
+        )
+        self.scheduler = PartialScheduler(self.upstream_pool.max_concurrency, max_waiting=max_queued_partials)
+
+        REGISTRY.gauge('asr_active_sessions', 'Connected ASR clients.', lambda: len(self.clients))
+        REGISTRY.gauge('asr_sessions_rejected', 'Sessions refused at capacity.', lambda: self.sessions_rejected)
+        REGISTRY.stats_gauges('asr_upstream_pool', 'Upstream ASR connection pool.', self.upstream_pool.stats)
+        REGISTRY.stats_gauges('asr_scheduler', 'Partial recognition scheduler.', self.scheduler.stats)
+        REGISTRY.stats_gauges('asr_energy_gate', 'Energy pre-gate in front of VAD.', self.energy_gate.stats)
+        REGISTRY.stats_gauges('asr_endpoints', 'End-of-utterance decisions.', self.endpoint_counters.stats)
+        REGISTRY.stats_gauges('asr_ingest', 'Client audio received, by codec.', self.codec_counters.stats)
+
+    async def recognize(self, wav_data):
+        return await self.upstream_pool.recognize(wav_data, self.upstream_timeout)
 
+    def new_transcript(self):
+        return SlidingWindowTranscript(int(self.window_seconds * self.sample_rate) * 2)
+
+    async def send_transcription(self, session, transcript, ticket, requested_frame, response):
         try:
-            async with websockets.connect('wss://asr.gpu.rdhasaki.com/se') as asr_websocket:
-                await asr_websocket.send(wav_data)
-                response = await asr_websocket.recv()
-                
+            response_json = json.loads(response)
+            if "text" in response_json:
+                final_response = {
+                    "text": transcript.apply(ticket, response_json["text"]),
+                    "reset_session": False,
+                    "utterance_id": current_trace.get()
+                }
+                if transcript is session.transcript:
+                    session.endpointer.on_partial(final_response["text"], requested_frame)
+                    session.transcript_updated.set()
+                    # Lets the app tell a pause from ongoing speech.
+                    final_response["trailing_silence"] = round(session.endpointer.silence(), 3)
+                logger.info(f"Speech recognized for client {session.client_id}: {final_response['text']}")
+                with span('asr_send'):
+                    await session.websocket.send(json.dumps(final_response))
+                session.partials_sent += 1
+                logger.info(f"Sent transcription to client {session.client_id}")
+            else:
+                logger.warning(f"Unexpected response format: {response_json}")
+        except json.JSONDecodeError:
+            logger.error(f"Failed to decode JSON response: {response}")
+
+    def process_audio_frames(self, session, start, stop, ticket):
+        requested = start
+        start, stop = session.audio.span(start, stop)
+        if start > requested:
+            if not session.audio_lost:
+                logger.warning(f"Audio was overwritten before it was sent upstream for client {session.client_id}, transcript will be incomplete")
+            session.audio_lost += start - requested
+        if start == stop:
+            return
+
+        wav_header = create_wav_header(self.sample_rate, 1, 16, stop - start)
+        wav_data = session.audio.read(start, stop, wav_header)
+
+        # Commits (ticket with a slot) carry a fixed part of the transcript and
+        # must never be superseded by a later partial.
+        self.scheduler.submit(
+            session.client_id,
+            partial(self.recognize, wav_data),
+            partial(self.send_transcription, session, session.transcript, ticket, session.endpointer.frame),
+            supersedable=ticket[1] is None
+        )
+
+    def request_partial(self, session):
+        speech_duration = len(session.audio) / (2 * self.sample_rate)
+        start, stop, ticket = session.transcript.next_request(len(session.audio))
+        logger.info(f"Processing {speech_duration:.2f}s utterance, sending {stop - start} of {len(session.audio)} bytes for client {session.client_id}")
+        
+        self.process_audio_frames(session, start, stop, ticket)
+        
+        session.last_process_offset = len(session.audio)
+
+    def transcript_complete(self, session):
+        return session.endpointer.covers_speech() and not session.transcript.pending_commit
+
+    async def wait_for_transcript(self, session):
+        """Wait up to ``final_wait`` for results covering all of the utterance's speech.
+
+        Frames of this session aren't processed meanwhile, so the next
+        utterance can't start before the final of this one is out.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.final_wait
+        with span('asr_final_wait'):
+            while not self.transcript_complete(session):
+                session.transcript_updated.clear()
                 try:
-                    response_json = json.loads(response)
-                    if "text" in response_json:
-                        final_response = {
-                            "text": response_json["text"],
-                            "reset_session": self.reset_session
-                        }
-                        self.current_transcription = response_json['text']
-                        logger.info(f"Speech recognized for client {client_id}: {final_response['text']}")
-                        await websocket.send(json.dumps(final_response))
-                        logger.info(f"Sent transcription to client {client_id}")
-                    else:
-                        logger.warning(f"Unexpected response format: {response_json}")
-                except json.JSONDecodeError:
-                    logger.error(f"Failed to decode JSON response: {response}")
-                
-                finally:
-                    await asr_websocket.send(b'')
-                
-        except Exception as e:
-            logger.error(f"Error in ASR service communication: {e}")
+                    await asyncio.wait_for(session.transcript_updated.wait(), deadline - loop.time())
+                except asyncio.TimeoutError:
+                    return False
+        return True
 
-    def process_audio_frames(self, client_id, websocket, frames):
-        if frames and client_id in self.loops:
-            asyncio.run_coroutine_threadsafe(
-                self.process_audio_segment(client_id, websocket, frames), 
-                self.loops[client_id]
-            )
+    async def send_final(self, session):
+        endpointer = session.endpointer
+        logger.debug(f"Utterance ended after {endpointer.silence():.2f}s of silence ({endpointer.last_end_reason}), resetting buffer for client {session.client_id}")
+        observe('asr_endpoint', endpointer.silence())
+        # A timeout can end the utterance while the results for its last
+        # words, or a commit, are still in flight; superseding them below
+        # would lose those words.
+        if not await self.wait_for_transcript(session):
+            self.endpoint_counters.stale += 1
+            logger.warning(f"Sending final for client {session.client_id} without a transcript of all its speech")
+        session.end_utterance()
+        self.scheduler.supersede(session.client_id)
+
+        response = {
+            "text": session.transcript.text,
+            "reset_session": True,
+            "utterance_id": session.utterance_id
+        }
+
+        with span('asr_send'):
+            await session.websocket.send(json.dumps(response))
+        session.finals_sent += 1
 
-    def start_event_loop(self, client_id):
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        self.loops[client_id] = loop
-        loop.run_forever()
-        logger.info(f"Event loop for client {client_id} stopped")
+        logger.info(f"Sent reset session")
+
+    async def process_frame(self, session, frame, is_speech, current_time):
+        session.frames += 1
+        if is_speech:
+            session.speech_frames += 1
+
+        event = session.endpointer.feed(is_speech, committing=session.transcript.pending_commit)
+        if event == IDLE:
+            return
+        if event == END:
+            await self.send_final(session)
+            return
+
+        if event == START:
+            logger.debug(f"Speech started for client {session.client_id}")
+            session.start_utterance(current_time, self.new_transcript())
+            # Partials submitted from here on are tagged with this utterance.
+            current_trace.set(session.utterance_id)
+
+        session.audio.extend(frame)
+
+        if event in (START, SPEECH):
+            session.last_speech_time = current_time
+        else:
+            session.transcript.mark_pause(len(session.audio))
+
+        # FLUSH is trailing silence: fetch a transcript of the whole
+        # utterance so the endpointer can tell whether it has settled.
+        if event == FLUSH or len(session.audio) - session.last_process_offset >= self.process_bytes:
+            self.request_partial(session)
+
+    def memory_report(self):
+        """Per-session memory use plus totals, for sizing gateway hosts."""
+        sessions = {client_id: session.memory_report() for client_id, session in self.clients.items()}
+        total = sum(report["total"] for report in sessions.values())
+        return {
+            "sessions": len(sessions),
+            "audio_capacity_per_session": self.audio_capacity,
+            "total_bytes": total,
+            "avg_bytes_per_session": total / len(sessions) if sessions else 0,
+            "per_session": sessions,
+        }
+
+    @staticmethod
+    def session_id_for(query):
+        """Reuse the caller's ``?session=`` ID so spans line up across services."""
+        session_id = query.get('session', [''])[0]
+        return session_id if _SESSION_ID.match(session_id) else new_session_id()
+
+    def new_endpointer(self, query):
+        """Each session gets its own endpointer, tunable with ``?min_silence=&max_silence=``."""
+        def seconds(name, default):
+            try:
+                return min(10.0, max(0.05, float(query[name][0])))
+            except (KeyError, ValueError):
+                return default
+
+        return Endpointer(
+            self.endpoint_counters,
+            frame_seconds=self.frame_duration / 1000,
+            min_silence=seconds('min_silence', self.min_silence),
+            max_silence=seconds('max_silence', self.max_silence),
+            stable_partials=self.stable_partials
+        )
+
+    def process_request(self, connection, request):
+        url = urlsplit(request.path)
+        if url.path == '/metrics':
+            return connection.respond(HTTPStatus.OK, REGISTRY.render())
+        if self.max_sessions and len(self.clients) >= self.max_sessions:
+            self.sessions_rejected += 1
+            logger.warning(f"Refusing session, at capacity ({len(self.clients)} sessions)")
+            return connection.respond(HTTPStatus.SERVICE_UNAVAILABLE, "ASR gateway is at capacity, retry shortly\n")
+        # Refuse unknown codecs before the handshake, so clients can retry with PCM.
+        codec = parse_qs(url.query).get('codec', ['pcm'])[0]
+        if codec not in DECODERS:
+            return connection.respond(
+                HTTPStatus.UNSUPPORTED_MEDIA_TYPE,
+                f"Unsupported codec {codec!r}, expected one of: {', '.join(available_codecs())}\n"
+            )
+        return None
 
     async def handle_client(self, websocket):
         client_id = id(websocket)
+        query = parse_qs(urlsplit(websocket.request.path).query)
+        codec = query.get('codec', ['pcm'])[0]
         
-        self.clients[client_id] = {
-            'speech_detected': False,
-            'last_process_time': time.time(),
-            'speech_buffer': bytearray(),
-            'speech_start_time': None,
-            'last_speech_time': None,
-            'silence_start_time': None
-        }
-        
-        self.executors[client_id] = ThreadPoolExecutor(max_workers=1)
-        self.executors[client_id].submit(self.start_event_loop, client_id)
+        session = ASRSession(
+            client_id,
+            self.session_id_for(query),
+            websocket,
+            self.frame_bytes,
+            self.audio_capacity,
+            self.new_transcript(),
+            self.new_endpointer(query),
+            codec=codec,
+            decoder=create_decoder(codec)
+        )
+        self.clients[client_id] = session
+        self.codec_counters.sessions[codec] = self.codec_counters.sessions.get(codec, 0) + 1
         
-        logger.info(f"New client connected: {client_id}")
+        logger.info(f"New client connected: {client_id} (session {session.session_id}, codec {codec})")
         
         try:
             async for message in websocket:
-                client = self.clients[client_id]
+                if isinstance(message, str):
+                    logger.warning(f"Ignoring text message from client {client_id}")
+                    continue
+
                 current_time = time.time()
-                frame_for_vad = self.convert_buffer_size(message)
+                session.bytes_received += len(message)
+                self.codec_counters.wire_bytes += len(message)
+
+                if session.decoder is not None:
+                    try:
+                        with span('asr_decode'):
+                            message = session.decoder.decode(message)
+                    except Exception as e:
+                        self.codec_counters.decode_errors += 1
+                        logger.warning(f"Dropping undecodable {codec} packet from client {client_id}: {e}")
+                        continue
+                session.bytes_decoded += len(message)
+                self.codec_counters.pcm_bytes += len(message)
                 
                 try:
-                    is_speech = self.vad.is_speech(frame_for_vad, self.sample_rate)
-                    
-                    if is_speech:
-                        client['silence_start_time'] = None
-                        
-                        if not client['speech_detected']:
-                            logger.debug(f"Speech started for client {client_id}")
-                            client['speech_detected'] = True
-                            client['speech_buffer'] = bytearray()
-                            client['speech_start_time'] = current_time
-                            client['last_process_time'] = current_time
-                        
-                        client['last_speech_time'] = current_time
-                        
-                        client['speech_buffer'].extend(message)
-                        
-                        if current_time - client['last_process_time'] >= self.processing_interval:
-                            speech_duration = current_time - client['speech_start_time']
-                            logger.info(f"Processing {speech_duration:.2f}s accumulated chunk of {len(client['speech_buffer'])} bytes for client {client_id}")
-                            
-                            self.process_audio_frames(
-                                client_id, 
-                                websocket, 
-                                bytes(client['speech_buffer'])
-                            )
-                            
-                            client['last_process_time'] = current_time
-                    else:
-                        if client['speech_detected']:
-                            if client['silence_start_time'] is None:
-                                client['silence_start_time'] = current_time
-                            
-                            if (current_time - client['silence_start_time'] >= self.silence_threshold):
-                                logger.debug(f"Silence detected for {self.silence_threshold}s, resetting buffer for client {client_id}")
-                                client['speech_detected'] = False
-                                client['speech_buffer'] = bytearray()
-                                client['speech_start_time'] = None
-                                client['last_speech_time'] = None
-                                client['silence_start_time'] = None
-
-                                self.reset_session = True
-
-                                response = {
-                                    "text": self.current_transcription,
-                                    "reset_session": self.reset_session
-                                }
-
-                                await websocket.send(json.dumps(response))
-
-                                self.reset_session = False
-                                logger.info(f"Sent reset session")
-                            else:
-                                client['speech_buffer'].extend(message)
+                    for block in session.splitter.feed(message):
+                        frames = [
+                            block[index:index + self.frame_bytes]
+                            for index in range(0, len(block), self.frame_bytes)
+                        ]
+                        with span('asr_vad'):
+                            loud = self.energy_gate.loud_frames(block)
+                            speech = [
+                                bool(is_loud) and self.vad.is_speech(frame, self.sample_rate)
+                                for frame, is_loud in zip(frames, loud)
+                            ]
+                        for frame, is_speech in zip(frames, speech):
+                            await self.process_frame(session, frame, is_speech, current_time)
             
                 except Exception as e:
                     logger.error(f"Error processing frame: {e}")
@@ -193,34 +369,81 @@ class ASRWebSocketServer:
             if client_id in self.clients:
                 del self.clients[client_id]
             
-            if client_id in self.loops:
-                self.loops[client_id].call_soon_threadsafe(self.loops[client_id].stop)
+            self.scheduler.remove(client_id)
             
-            if client_id in self.executors:
-                self.executors[client_id].shutdown(wait=False)
-                del self.executors[client_id]
-            
-            if client_id in self.loops:
-                del self.loops[client_id]
-            
-            logger.info(f"Client {client_id} cleanup complete")
+            logger.info(f"Client {client_id} cleanup complete: {session.stats()}")
+            logger.debug(f"Session memory for client {client_id}: {session.memory_report()}")
+            logger.debug(f"Upstream pool stats: {self.upstream_pool.stats()}")
+            logger.debug(f"Scheduler stats: {self.scheduler.stats()}")
+            logger.debug(f"Energy gate stats: {self.energy_gate.stats()}")
 
-    async def start_server(self):
-        server = await websockets.serve(
-            self.handle_client, 
-            self.host, 
-            self.port
-        )
+    def stats(self):
+        return {
+            "sessions": len(self.clients),
+            "sessions_rejected": self.sessions_rejected,
+            "upstream_pool": self.upstream_pool.stats(),
+            "scheduler": self.scheduler.stats(),
+            "energy_gate": self.energy_gate.stats(),
+            "endpoints": self.endpoint_counters.stats(),
+            "ingest": self.codec_counters.stats(),
+        }
+
+    async def drain(self, timeout=ASR_DRAIN_SECONDS):
+        """Stop accepting connections, give open sessions ``timeout`` seconds to end, then close them."""
+        if self.server is None or self.draining:
+            return
+        self.draining = True
+        logger.info(f"Draining {len(self.clients)} sessions")
+
+        # Closing the listening socket alone leaves open connections alone.
+        self.server.server.close()
+        deadline = time.monotonic() + timeout
+        while self.clients and time.monotonic() < deadline:
+            await asyncio.sleep(0.2)
+
+        if self.clients:
+            logger.warning(f"Closing {len(self.clients)} sessions still open after {timeout}s")
+        self.server.close()
+
+    async def start_server(self, sock=None, drain_on_sigterm=False):
+        await self.upstream_pool.start()
+
+        if sock is not None:
+            self.server = await websockets.serve(
+                self.handle_client,
+                sock=sock,
+                process_request=self.process_request
+            )
+        else:
+            self.server = await websockets.serve(
+                self.handle_client, 
+                self.host, 
+                self.port,
+                process_request=self.process_request
+            )
+
+        if drain_on_sigterm:
+            asyncio.get_running_loop().add_signal_handler(
+                signal.SIGTERM, lambda: asyncio.create_task(self.drain())
+            )
 
         logger.info(f"Realtime ASR WebSocket server started at ws://{self.host}:{self.port}")
         
-        await server.wait_closed()
+        try:
+            await self.server.wait_closed()
+        finally:
+            await self.upstream_pool.close()
 
 def main():
+    if ASR_WORKERS > 1:
+        from backend.gateway import GatewaySupervisor
+        GatewaySupervisor(ASR_WORKERS, drain_timeout=ASR_DRAIN_SECONDS).run()
+        return
+
     server = ASRWebSocketServer()
     
     try:
-        asyncio.run(server.start_server())
+        asyncio.run(server.start_server(drain_on_sigterm=True))
     except KeyboardInterrupt:
         logger.info("Server stopped by user")
     except Exception as e:
@@ -0,0 +1,191 @@
+import asyncio
+import logging
+import os
+import struct
+import time
+from contextlib import asynccontextmanager
+
+import websockets
+from websockets.protocol import State
+
+from backend.metrics import observe, span
+
+logger = logging.getLogger('asr_pool')
+
+ASR_UPSTREAM_URL = os.getenv('ASR_UPSTREAM_URL', 'wss://asr.gpu.rdhasaki.com/se')
+
+
+def create_wav_header(sample_rate, channels, bits_per_sample, data_length):
+    header = bytearray()
+    header.extend(b'RIFF')
+    header.extend(struct.pack('<L', 36 + data_length))
+    header.extend(b'WAVE')
+    header.extend(b'fmt ')
+    header.extend(struct.pack('<L', 16))
+    header.extend(struct.pack('<H', 1))
+    header.extend(struct.pack('<H', channels))
+    header.extend(struct.pack('<L', sample_rate))
+    header.extend(struct.pack('<L', sample_rate * channels * bits_per_sample // 8))
+    header.extend(struct.pack('<H', channels * bits_per_sample // 8))
+    header.extend(struct.pack('<H', bits_per_sample))
+    header.extend(b'data')
+    header.extend(struct.pack('<L', data_length))
+    return bytes(header)
+
+
+class ASRConnectionPool:
+    """Keeps persistent websocket connections to the upstream ASR service.
+
+    Connections are handed out exclusively through ``acquire()``; at most
+    ``max_concurrency`` requests are in flight at once and up to ``size``
+    idle connections are kept open between requests.
+    """
+
+    def __init__(self, url, size=4, max_concurrency=None, connect_timeout=5.0,
+                 ping_timeout=2.0, idle_check_after=10.0):
+        self.url = url
+        self.size = size
+        self.max_concurrency = max_concurrency or size
+        self.connect_timeout = connect_timeout
+        self.ping_timeout = ping_timeout
+        self.idle_check_after = idle_check_after
+
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._idle = []
+        self._closed = False
+
+        self.open_connections = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.acquired = 0
+        self.connects = 0
+        self.reconnects = 0
+        self.failures = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def start(self):
+        """Open the idle connections up front so the first partials skip the handshake."""
+        for _ in range(self.size - len(self._idle)):
+            try:
+                conn = await self._connect()
+            except Exception as e:
+                logger.warning(f"Could not pre-open upstream ASR connection: {e}")
+                break
+            self._idle.append((conn, time.monotonic()))
+
+    async def close(self):
+        self._closed = True
+        idle, self._idle = self._idle, []
+        for conn, _ in idle:
+            await self._discard(conn)
+
+    async def _connect(self):
+        conn = await asyncio.wait_for(websockets.connect(self.url), self.connect_timeout)
+        self.open_connections += 1
+        self.connects += 1
+        logger.info(f"Opened upstream ASR connection ({self.open_connections} open)")
+        return conn
+
+    async def _discard(self, conn):
+        self.open_connections -= 1
+        try:
+            await conn.close()
+        except Exception:
+            pass
+
+    async def _is_healthy(self, conn, idle_since):
+        if conn.state is not State.OPEN:
+            return False
+        if time.monotonic() - idle_since < self.idle_check_after:
+            return True
+        try:
+            pong_waiter = await conn.ping()
+            await asyncio.wait_for(pong_waiter, self.ping_timeout)
+            return True
+        except Exception:
+            return False
+
+    async def _checkout(self):
+        while self._idle:
+            conn, idle_since = self._idle.pop()
+            if await self._is_healthy(conn, idle_since):
+                return conn
+            logger.info("Dropping unhealthy upstream ASR connection, reconnecting")
+            self.reconnects += 1
+            await self._discard(conn)
+        return await self._connect()
+
+    def _checkin(self, conn):
+        if self._closed or conn.state is not State.OPEN or len(self._idle) >= self.size:
+            return False
+        self._idle.append((conn, time.monotonic()))
+        return True
+
+    @asynccontextmanager
+    async def acquire(self):
+        """Yield an open upstream connection for the duration of one request.
+
+        A connection is returned to the pool only when the block exits
+        cleanly; any exception closes it so a half-read response can never
+        leak into the next request.
+        """
+        wait_start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+
+        waited = time.monotonic() - wait_start
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+        observe('asr_pool_wait', waited)
+        self.acquired += 1
+
+        try:
+            try:
+                conn = await self._checkout()
+            except Exception:
+                self.failures += 1
+                raise
+
+            self.in_use += 1
+            try:
+                yield conn
+            except BaseException:
+                self.failures += 1
+                await self._discard(conn)
+                raise
+            else:
+                if not self._checkin(conn):
+                    await self._discard(conn)
+            finally:
+                self.in_use -= 1
+        finally:
+            self._semaphore.release()
+
+    async def recognize(self, wav_data, timeout):
+        """Send one WAV file upstream and return the service's JSON reply."""
+        async with self.acquire() as conn:
+            with span('asr_upstream'):
+                await conn.send(wav_data)
+                response = await asyncio.wait_for(conn.recv(), timeout)
+            await conn.send(b'')
+        return response
+
+    def stats(self):
+        return {
+            "size": self.size,
+            "max_concurrency": self.max_concurrency,
+            "open": self.open_connections,
+            "idle": len(self._idle),
+            "in_use": self.in_use,
+            "waiting": self.waiting,
+            "acquired": self.acquired,
+            "connects": self.connects,
+            "reconnects": self.reconnects,
+            "failures": self.failures,
+            "wait_avg_ms": 1000.0 * self.wait_total / self.acquired if self.acquired else 0.0,
+            "wait_max_ms": 1000.0 * self.wait_max,
+        }
@@ -0,0 +1,191 @@
+import asyncio
+import hashlib
+import logging
+import mmap
+import os
+import re
+import unicodedata
+from collections import OrderedDict
+
+logger = logging.getLogger('audio_cache')
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_sentence(text):
+    text = unicodedata.normalize('NFC', text)
+    return _WHITESPACE.sub(' ', text).strip().casefold()
+
+
+class AudioCache:
+    """LRU cache of synthesized sentence audio keyed by (voice, sentence).
+
+    The memory tier is bounded by the total number of audio bytes it holds.
+    If ``disk_dir`` is set, every entry is also written there as one file,
+    bounded by ``max_disk_bytes``; disk entries are read back through
+    ``mmap`` and survive restarts. Disk reads and writes run in a worker
+    thread, so a slow disk never stalls the event loop. Empty audio is
+    never cached, so a failed synthesis isn't replayed as silence.
+    """
+
+    def __init__(self, max_bytes=32 * 1024 * 1024, disk_dir=None, max_disk_bytes=512 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.max_disk_bytes = max_disk_bytes
+
+        self._entries = OrderedDict()
+        self.bytes = 0
+
+        self._disk = OrderedDict()
+        self.disk_bytes = 0
+        # Background disk writes, by key.
+        self._writes = {}
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.disk_evictions = 0
+
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def make_key(voice, text):
+        return hashlib.sha1(f"{voice}\n{normalize_sentence(text)}".encode('utf-8')).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, f"{key}.mp3")
+
+    def _load_disk_index(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if not name.endswith('.mp3'):
+                continue
+            stat = os.stat(os.path.join(self.disk_dir, name))
+            if not stat.st_size:
+                continue
+            files.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(files):
+            self._disk[key] = size
+            self.disk_bytes += size
+        logger.info(f"Loaded {len(self._disk)} cached sentences ({self.disk_bytes} bytes) from {self.disk_dir}")
+        self._remove_files(self._evict_disk())
+
+    async def get(self, voice, text):
+        key = self.make_key(voice, text)
+
+        audio = self._entries.get(key)
+        if audio is not None:
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return audio
+
+        if key in self._disk:
+            audio = await self._read_disk(key)
+            if audio is not None:
+                self.disk_hits += 1
+                self._store_memory(key, audio)
+                return audio
+
+        self.misses += 1
+        return None
+
+    def put(self, voice, text, audio):
+        if not audio:
+            return
+        key = self.make_key(voice, text)
+        audio = bytes(audio)
+        self._store_memory(key, audio)
+        if self.disk_dir and key not in self._disk and key not in self._writes:
+            task = asyncio.get_running_loop().create_task(self._write_disk(key, audio))
+            self._writes[key] = task
+            task.add_done_callback(lambda _: self._writes.pop(key, None))
+
+    def _store_memory(self, key, audio):
+        if len(audio) > self.max_bytes:
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.bytes -= len(previous)
+        self._entries[key] = audio
+        self.bytes += len(audio)
+        while self.bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.bytes -= len(evicted)
+            self.evictions += 1
+
+    @staticmethod
+    def _read_file(path):
+        # mmap can't map an empty file, so empty entries are unreadable too.
+        with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            audio = mapped[:]
+        os.utime(path)
+        return audio
+
+    @staticmethod
+    def _write_file(path, audio):
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(audio)
+        os.replace(tmp_path, path)
+
+    @staticmethod
+    def _remove_files(paths):
+        for path in paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    async def _read_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            audio = await asyncio.to_thread(self._read_file, path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Dropping unreadable cache entry {path}: {e}")
+            self.disk_bytes -= self._disk.pop(key, 0)
+            return None
+        if key in self._disk:
+            self._disk.move_to_end(key)
+        return audio
+
+    async def _write_disk(self, key, audio):
+        path = self._disk_path(key)
+        try:
+            await asyncio.to_thread(self._write_file, path, audio)
+        except OSError as e:
+            logger.warning(f"Could not write cache entry {path}: {e}")
+            return
+        self._disk[key] = len(audio)
+        self.disk_bytes += len(audio)
+        evicted = self._evict_disk()
+        if evicted:
+            await asyncio.to_thread(self._remove_files, evicted)
+
+    def _evict_disk(self):
+        """Drop the oldest disk entries over ``max_disk_bytes``; returns their paths to delete."""
+        evicted = []
+        while self.disk_bytes > self.max_disk_bytes and self._disk:
+            key, size = self._disk.popitem(last=False)
+            self.disk_bytes -= size
+            self.disk_evictions += 1
+            evicted.append(self._disk_path(key))
+        return evicted
+
+    def stats(self):
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_bytes": self.max_bytes,
+            "disk_entries": len(self._disk),
+            "disk_bytes": self.disk_bytes,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "disk_evictions": self.disk_evictions,
+        }
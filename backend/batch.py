@@ -0,0 +1,338 @@
+"""Offline batch transcription of recorded calls.
+
+Segments WAV files with the gateway's VAD (energy gate, webrtcvad and the
+endpointer) as fast as the CPU allows, sends the segments to the upstream
+ASR service with bounded parallelism and appends one JSON line per file:
+
+    python -m backend.batch /archive/calls --output calls.jsonl --concurrency 8
+
+Rerunning the same command resumes: files that already have a result in
+the output are skipped, files that failed are retried.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import mmap
+import os
+import struct
+import time
+from pathlib import Path
+
+import numpy as np
+import webrtcvad
+
+from backend.asr_pool import ASR_UPSTREAM_URL, ASRConnectionPool, create_wav_header
+from backend.endpoint import END, IDLE, START, EndpointCounters, Endpointer
+from backend.vad import EnergyGate
+
+logger = logging.getLogger('batch')
+
+SAMPLE_RATE = 16000
+FRAME_SECONDS = 0.03
+FRAME_SIZE = int(SAMPLE_RATE * FRAME_SECONDS)
+FRAME_BYTES = FRAME_SIZE * 2
+
+
+def read_pcm(path):
+    """16 kHz mono 16-bit PCM of a WAV file.
+
+    Files already in that format are memory-mapped, so only the segments
+    being sent are ever paged in; anything else is downmixed and resampled
+    in memory.
+    """
+    with open(path, 'rb') as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if mapped[:4] != b'RIFF' or mapped[8:12] != b'WAVE':
+        raise ValueError("not a RIFF/WAVE file")
+
+    fmt = None
+    offset = 12
+    while offset + 8 <= len(mapped):
+        chunk_id = mapped[offset:offset + 4]
+        size, = struct.unpack_from('<L', mapped, offset + 4)
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            fmt = struct.unpack_from('<HHLLHH', mapped, body)
+        elif chunk_id == b'data':
+            if fmt is None:
+                raise ValueError("data chunk before fmt chunk")
+            audio_format, channels, sample_rate, _, _, bits = fmt
+            if audio_format != 1 or bits != 16:
+                raise ValueError(f"only 16-bit PCM is supported (format {audio_format}, {bits} bits)")
+            data = memoryview(mapped)[body:min(body + size, len(mapped))]
+            if (channels, sample_rate) == (1, SAMPLE_RATE):
+                return data
+            return _convert(data, channels, sample_rate)
+        offset = body + size + (size & 1)
+    raise ValueError("no data chunk")
+
+
+def _convert(data, channels, sample_rate):
+    samples = np.frombuffer(data, dtype='<i2')
+    samples = samples[:len(samples) // channels * channels].reshape(-1, channels).mean(axis=1)
+    if sample_rate != SAMPLE_RATE:
+        positions = np.arange(int(len(samples) * SAMPLE_RATE / sample_rate)) * (sample_rate / SAMPLE_RATE)
+        samples = np.interp(positions, np.arange(len(samples)), samples)
+    return memoryview(samples.astype('<i2').tobytes())
+
+
+def find_segments(pcm, silence=0.5, max_segment_seconds=30.0, energy_threshold=100.0, block_frames=1000):
+    """``(start, stop)`` byte ranges of the utterances in ``pcm``.
+
+    An utterance ends after ``silence`` seconds without speech, like a
+    gateway session that gets no partials, and is cut every
+    ``max_segment_seconds`` if it runs on.
+    """
+    vad = webrtcvad.Vad(3)
+    gate = EnergyGate(FRAME_SIZE, threshold=energy_threshold)
+    endpointer = Endpointer(EndpointCounters(), frame_seconds=FRAME_SECONDS,
+                            min_silence=silence, max_silence=silence)
+    max_frames = int(max_segment_seconds / FRAME_SECONDS)
+    total_frames = len(pcm) // FRAME_BYTES
+
+    segments = []
+    start = None
+    for block_start in range(0, total_frames, block_frames):
+        block_end = min(total_frames, block_start + block_frames)
+        block = pcm[block_start * FRAME_BYTES:block_end * FRAME_BYTES]
+        for index, loud in enumerate(gate.loud_frames(block), block_start):
+            frame = block[(index - block_start) * FRAME_BYTES:(index - block_start + 1) * FRAME_BYTES]
+            event = endpointer.feed(bool(loud) and vad.is_speech(frame, SAMPLE_RATE))
+            if event == IDLE:
+                continue
+            if event == START:
+                start = index
+            elif event == END:
+                segments.append((start * FRAME_BYTES, index * FRAME_BYTES))
+                start = None
+            elif index - start >= max_frames:
+                segments.append((start * FRAME_BYTES, index * FRAME_BYTES))
+                start = index
+    if start is not None:
+        segments.append((start * FRAME_BYTES, total_frames * FRAME_BYTES))
+    return segments
+
+
+def load_done(output):
+    """Files with a successful result in ``output``; the last record for a file wins."""
+    results = {}
+    if not os.path.exists(output):
+        return set()
+    with open(output, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # A line cut short when the previous run was killed.
+                continue
+            results[record.get("file")] = record
+    return {path for path, record in results.items() if "error" not in record}
+
+
+def find_wavs(inputs):
+    for item in inputs:
+        path = Path(item)
+        if path.is_dir():
+            yield from sorted(p for p in path.rglob('*') if p.suffix.lower() == '.wav')
+        else:
+            yield path
+
+
+class _FileJob:
+    __slots__ = ('path', 'duration', 'segments', 'texts', 'pending', 'error', 'started')
+
+    def __init__(self, path, duration, segments):
+        self.path = path
+        self.duration = duration
+        self.segments = segments
+        self.texts = [None] * len(segments)
+        self.pending = len(segments)
+        self.error = None
+        self.started = time.monotonic()
+
+    def record(self):
+        if self.error is not None:
+            return {"file": self.path, "error": self.error}
+        return {
+            "file": self.path,
+            "duration": round(self.duration, 3),
+            "segments": [
+                {"start": round(start / (2 * SAMPLE_RATE), 3), "end": round(stop / (2 * SAMPLE_RATE), 3), "text": text}
+                for (start, stop), text in zip(self.segments, self.texts)
+            ],
+            "text": " ".join(text for text in self.texts if text),
+            "elapsed": round(time.monotonic() - self.started, 3),
+        }
+
+
+class BatchTranscriber:
+    """Transcribes WAV files through the upstream ASR service, ``concurrency`` segments at a time.
+
+    Files are segmented in a worker thread, one ahead of the upstream
+    requests, and the segments of several files can be in flight at once.
+    Each file's result is appended to ``output`` as soon as its last
+    segment comes back.
+    """
+
+    def __init__(self, output, upstream_url=ASR_UPSTREAM_URL, concurrency=4, silence=0.5,
+                 max_segment_seconds=30.0, timeout=30.0, retries=2):
+        self.output = output
+        self.concurrency = concurrency
+        self.silence = silence
+        self.max_segment_seconds = max_segment_seconds
+        self.timeout = timeout
+        self.retries = retries
+        self.pool = ASRConnectionPool(upstream_url, size=concurrency)
+
+        self.files_done = 0
+        self.files_failed = 0
+        self.files_skipped = 0
+        self.segments_sent = 0
+        self.audio_seconds = 0.0
+        self._out = None
+        self._pcm = {}
+
+    def _segment(self, path):
+        pcm = read_pcm(path)
+        return pcm, find_segments(pcm, self.silence, self.max_segment_seconds)
+
+    async def _recognize(self, pcm, start, stop):
+        wav_data = create_wav_header(SAMPLE_RATE, 1, 16, stop - start) + bytes(pcm[start:stop])
+        for attempt in range(self.retries + 1):
+            try:
+                response = await self.pool.recognize(wav_data, self.timeout)
+                self.segments_sent += 1
+                return json.loads(response).get("text", "")
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning(f"Retrying segment after upstream error: {e}")
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+    def _finish(self, job):
+        self._pcm.pop(job.path, None)
+        if job.error is None:
+            self.files_done += 1
+            self.audio_seconds += job.duration
+        else:
+            self.files_failed += 1
+            logger.error(f"Failed to transcribe {job.path}: {job.error}")
+        self._out.write(json.dumps(job.record(), ensure_ascii=False) + "\n")
+        self._out.flush()
+
+    async def _worker(self, queue):
+        while True:
+            item = await queue.get()
+            if item is None:
+                return
+            job, index = item
+            start, stop = job.segments[index]
+            if job.error is None:
+                try:
+                    job.texts[index] = await self._recognize(self._pcm[job.path], start, stop)
+                except Exception as e:
+                    job.error = f"segment {index}: {type(e).__name__}: {e}"
+            job.pending -= 1
+            if job.pending == 0:
+                self._finish(job)
+
+    async def run(self, inputs):
+        done = load_done(self.output)
+        # Finish a line cut short by a crash so new records start on their own line.
+        if os.path.exists(self.output) and os.path.getsize(self.output):
+            with open(self.output, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                needs_newline = f.read(1) != b'\n'
+        else:
+            needs_newline = False
+
+        await self.pool.start()
+        queue = asyncio.Queue(maxsize=self.concurrency * 4)
+        workers = [asyncio.create_task(self._worker(queue)) for _ in range(self.concurrency)]
+        started = time.monotonic()
+        try:
+            with open(self.output, 'a', encoding='utf-8') as self._out:
+                if needs_newline:
+                    self._out.write("\n")
+                for path in find_wavs(inputs):
+                    key = str(path.resolve())
+                    if key in done:
+                        self.files_skipped += 1
+                        continue
+                    try:
+                        pcm, segments = await asyncio.to_thread(self._segment, path)
+                    except Exception as e:
+                        job = _FileJob(key, 0.0, [])
+                        job.error = f"{type(e).__name__}: {e}"
+                        self._finish(job)
+                        continue
+
+                    job = _FileJob(key, len(pcm) / (2 * SAMPLE_RATE), segments)
+                    if not segments:
+                        self._finish(job)
+                        continue
+                    self._pcm[key] = pcm
+                    for index in range(len(segments)):
+                        await queue.put((job, index))
+
+                for _ in workers:
+                    await queue.put(None)
+                await asyncio.gather(*workers)
+        finally:
+            for worker in workers:
+                worker.cancel()
+            await self.pool.close()
+
+        elapsed = time.monotonic() - started
+        logger.info(
+            f"Transcribed {self.files_done} files ({self.audio_seconds / 3600:.2f}h of audio) in {elapsed:.1f}s, "
+            f"{self.audio_seconds / elapsed if elapsed else 0.0:.1f}x real time; "
+            f"{self.files_failed} failed, {self.files_skipped} already done"
+        )
+        return self.stats()
+
+    def stats(self):
+        return {
+            "files_done": self.files_done,
+            "files_failed": self.files_failed,
+            "files_skipped": self.files_skipped,
+            "segments_sent": self.segments_sent,
+            "audio_seconds": self.audio_seconds,
+            "upstream_pool": self.pool.stats(),
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('inputs', nargs='+', help="WAV files or directories to search for them")
+    parser.add_argument('--output', required=True, help="JSONL file results are appended to")
+    parser.add_argument('--upstream-url', default=ASR_UPSTREAM_URL, help="upstream ASR websocket")
+    parser.add_argument('--concurrency', type=int, default=4, help="segments in flight at once")
+    parser.add_argument('--silence', type=float, default=0.5, help="seconds of silence that end a segment")
+    parser.add_argument('--max-segment-seconds', type=float, default=30.0, help="longest segment sent upstream")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for each upstream reply")
+    parser.add_argument('--retries', type=int, default=2, help="retries per segment before the file fails")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    transcriber = BatchTranscriber(
+        args.output,
+        upstream_url=args.upstream_url,
+        concurrency=args.concurrency,
+        silence=args.silence,
+        max_segment_seconds=args.max_segment_seconds,
+        timeout=args.timeout,
+        retries=args.retries
+    )
+    try:
+        asyncio.run(transcriber.run(args.inputs))
+    except KeyboardInterrupt:
+        logger.info("Stopped; rerun the same command to resume")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,454 @@
+"""End-to-end latency and concurrency benchmark.
+
+Replays WAV files (or a synthetic voiced signal) as N concurrent callers
+streaming in real time, either against the ASR gateway alone or through
+the full ASR -> LLM -> TTS pipeline, and writes percentiles to JSON.
+
+By default everything runs in-process against local stand-ins for the
+GPU ASR service, Gemini and edge-tts, with configurable latencies:
+
+    python -m backend.bench asr --callers 20
+    python -m backend.bench pipeline --callers 10 --wav a.wav b.wav --output run.json
+    python -m backend.bench pipeline --compare run.json
+
+Pass ``--url`` to benchmark an already running deployment instead.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import platform
+import time
+import wave
+
+import numpy as np
+import websockets
+
+from backend.mp3 import mp3_duration
+from backend.protocol import TTS_AUDIO_CHUNK, unpack_tts_audio, unpack_tts_chunk
+
+logger = logging.getLogger('bench')
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+
+
+def synthetic_speech(seconds):
+    """A harmonic-rich pulse train with a syllable-rate envelope that VAD accepts as speech."""
+    t = np.arange(int(SAMPLE_RATE * seconds)) / SAMPLE_RATE
+    f0 = 140 + 20 * np.sin(2 * np.pi * 1.3 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / SAMPLE_RATE
+    signal = sum(np.sin(k * phase) / k for k in range(1, 25))
+    signal *= 0.6 + 0.4 * np.sin(2 * np.pi * 4 * t)
+    return (signal / np.abs(signal).max() * 8000).astype('<i2').tobytes()
+
+
+def load_wav(path):
+    with wave.open(path, 'rb') as f:
+        if (f.getframerate(), f.getnchannels(), f.getsampwidth()) != (SAMPLE_RATE, 1, SAMPLE_WIDTH):
+            raise SystemExit(f"{path}: expected 16 kHz mono 16-bit PCM")
+        return f.readframes(f.getnframes())
+
+
+def summarize(values):
+    if not values:
+        return {"count": 0}
+    data = np.asarray(values) * 1000
+    p50, p95, p99 = np.percentile(data, [50, 95, 99])
+    return {
+        "count": len(values),
+        "mean_ms": float(data.mean()),
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "max_ms": float(data.max()),
+    }
+
+
+class Caller:
+    """One simulated caller: streams its audio in real time and timestamps replies."""
+
+    def __init__(self, index, audio, pipeline, chunk_seconds, trailing_silence):
+        self.index = index
+        self.audio = audio
+        self.pipeline = pipeline
+        self.chunk_bytes = int(SAMPLE_RATE * chunk_seconds) * SAMPLE_WIDTH
+        self.chunk_seconds = chunk_seconds
+        self.trailing_silence = trailing_silence
+
+        self.started = None
+        self.speech_end = None
+        self.first_partial = None
+        self.final = None
+        self.first_audio = None
+        self.gaps = []
+        self.stall_seconds = 0.0
+        self.audio_seconds = 0.0
+        self.error = None
+        self._done = asyncio.Event()
+        self._play_end = None
+        self._sentence = bytearray()
+        self._sentence_seconds = 0.0
+
+    def _on_audio(self, frame, now):
+        if frame[0] == TTS_AUDIO_CHUNK:
+            _, part, _, _, _, audio = unpack_tts_chunk(frame)
+            starts_sentence = part == 0
+            if starts_sentence:
+                self._sentence = bytearray()
+                self._sentence_seconds = 0.0
+            # Chunks are cut at arbitrary bytes; count the frames each one completes.
+            self._sentence.extend(audio)
+            seconds = mp3_duration(self._sentence)
+            duration, self._sentence_seconds = seconds - self._sentence_seconds, seconds
+        else:
+            _, _, _, audio = unpack_tts_audio(frame)
+            starts_sentence = True
+            duration = mp3_duration(audio)
+        if not audio:
+            return
+
+        if self.first_audio is None:
+            self.first_audio = now
+        # Playback schedule of a gapless client: audio starts when it arrives
+        # or when the previous audio finishes, whichever is later. Waiting
+        # inside a streamed sentence counts as a stall.
+        if self._play_end is not None:
+            gap = max(0.0, now - self._play_end)
+            if starts_sentence:
+                self.gaps.append(gap)
+            else:
+                self.stall_seconds += gap
+        self.audio_seconds += duration
+        self._play_end = max(now, self._play_end or now) + duration
+
+    def _on_message(self, data, now):
+        if self.pipeline:
+            kind = data.get("type")
+            if kind == "transcription" and self.final is None:
+                self.final = now
+            elif kind == "tts_complete":
+                self._done.set()
+            elif kind == "error":
+                self.error = data.get("data")
+                self._done.set()
+        elif "text" in data:
+            if data.get("reset_session"):
+                self.final = now
+                self._done.set()
+            elif self.first_partial is None:
+                self.first_partial = now
+
+    async def _receive(self, websocket):
+        async for message in websocket:
+            now = time.monotonic()
+            if isinstance(message, bytes):
+                self._on_audio(message, now)
+            else:
+                self._on_message(json.loads(message), now)
+
+    async def _send(self, websocket, payload):
+        start = time.monotonic()
+        for i in range(0, len(payload), self.chunk_bytes):
+            # Pace against an absolute schedule so sleeps don't accumulate drift.
+            delay = start + (i // self.chunk_bytes) * self.chunk_seconds - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            await websocket.send(payload[i:i + self.chunk_bytes])
+            if i + self.chunk_bytes >= len(self.audio) and self.speech_end is None:
+                self.speech_end = time.monotonic()
+
+    async def run(self, url, timeout):
+        silence = bytes(int(SAMPLE_RATE * self.trailing_silence) * SAMPLE_WIDTH)
+        try:
+            async with websockets.connect(url, max_size=None) as websocket:
+                if self.pipeline:
+                    # The pipeline announces when its ASR connection is up,
+                    # or says why it can't take the call.
+                    while True:
+                        message = json.loads(await websocket.recv())
+                        if message.get("type") == "error":
+                            raise RuntimeError(message.get("data"))
+                        if message.get("type") == "status":
+                            break
+                self.started = time.monotonic()
+                receiver = asyncio.create_task(self._receive(websocket))
+                try:
+                    await self._send(websocket, self.audio + silence)
+                    await asyncio.wait_for(self._done.wait(), timeout)
+                finally:
+                    receiver.cancel()
+        except asyncio.TimeoutError:
+            self.error = "timed out waiting for the response"
+        except Exception as e:
+            self.error = f"{type(e).__name__}: {e}"
+
+    def result(self):
+        def since(mark, origin):
+            return mark - origin if mark is not None and origin is not None else None
+
+        return {
+            "caller": self.index,
+            "speech_seconds": len(self.audio) / (SAMPLE_RATE * SAMPLE_WIDTH),
+            "time_to_first_partial": since(self.first_partial, self.started),
+            "endpoint_to_final": since(self.final, self.speech_end),
+            "time_to_first_audio": since(self.first_audio, self.speech_end),
+            "inter_sentence_gaps": self.gaps,
+            "playback_stall": self.stall_seconds if self.pipeline else None,
+            "response_audio_seconds": self.audio_seconds,
+            "error": self.error,
+        }
+
+
+class LocalStack:
+    """The ASR gateway, and optionally the app, wired to local stand-ins."""
+
+    def __init__(self, args):
+        self.args = args
+        self.fake_asr = None
+        self.asr_server = None
+        self.fake_llm = None
+        self.fake_tts = None
+        self._asr_task = None
+        self._app_task = None
+        self._uvicorn = None
+
+    async def start(self):
+        from backend.asr import ASRWebSocketServer
+        from backend.fake_asr import FakeASRServer
+
+        args = self.args
+        self.fake_asr = FakeASRServer(port=args.upstream_port, latency=args.asr_latency)
+        await self.fake_asr.start()
+
+        self.asr_server = ASRWebSocketServer(
+            host='127.0.0.1',
+            port=args.asr_port,
+            upstream_url=f"ws://127.0.0.1:{args.upstream_port}",
+            upstream_pool_size=args.pool_size,
+            recognition_mode=args.recognition_mode,
+            min_silence=args.min_silence,
+            max_silence=args.max_silence,
+        )
+        self._asr_task = asyncio.create_task(self.asr_server.start_server())
+        await self._wait_for_port(args.asr_port)
+
+        if args.mode == 'asr':
+            return f"ws://127.0.0.1:{args.asr_port}"
+
+        import uvicorn
+        from backend import app as app_module, segment, tts
+        from backend.fake_llm import FakeLLMBackend
+        from backend.fake_tts import FakeTTSBackend
+        from backend.llm import set_llm_backend
+        from backend.synth import set_tts_backend
+
+        self.fake_llm = FakeLLMBackend(first_token_latency=args.llm_latency)
+        self.fake_tts = FakeTTSBackend(first_byte_latency=args.tts_latency)
+        set_llm_backend(self.fake_llm)
+        set_tts_backend(self.fake_tts)
+        if not args.cache:
+            # Every caller says the same thing, so caches would turn all
+            # but the first response into hits.
+            tts.answer_cache.max_entries = 0
+            tts.audio_cache.max_bytes = 0
+        app_module.ASR_SERVER_URL = f"ws://127.0.0.1:{args.asr_port}"
+        app_module.SPECULATION = args.speculation
+        segment.TTS_SEGMENTATION = args.segmentation
+
+        config = uvicorn.Config(app_module.app, host='127.0.0.1', port=args.app_port, log_level='warning')
+        self._uvicorn = uvicorn.Server(config)
+        self._app_task = asyncio.create_task(self._uvicorn.serve())
+        while not self._uvicorn.started:
+            await asyncio.sleep(0.05)
+        return f"ws://127.0.0.1:{args.app_port}/asr-tts-full-pipeline"
+
+    @staticmethod
+    async def _wait_for_port(port):
+        for _ in range(100):
+            try:
+                async with websockets.connect(f"ws://127.0.0.1:{port}"):
+                    return
+            except OSError:
+                await asyncio.sleep(0.05)
+        raise RuntimeError(f"Nothing listening on port {port}")
+
+    def stats(self):
+        stats = {
+            "upstream_requests": self.fake_asr.requests,
+            "upstream_connections": self.fake_asr.connections,
+            "upstream_pool": self.asr_server.upstream_pool.stats(),
+            "scheduler": self.asr_server.scheduler.stats(),
+            "energy_gate": self.asr_server.energy_gate.stats(),
+            "endpoints": self.asr_server.endpoint_counters.stats(),
+            "asr_sessions_rejected": self.asr_server.sessions_rejected,
+        }
+        if self.fake_llm is not None:
+            from backend import app as app_module, speculation, tts
+
+            stats["llm_requests"] = self.fake_llm.requests
+            stats["tts_requests"] = self.fake_tts.requests
+            stats["speculation"] = speculation.counters.stats()
+            stats["app_sessions_rejected"] = app_module.sessions_rejected
+            stats["llm_limiter"] = tts.llm_limiter.stats()
+            stats["tts_limiter"] = tts.tts_limiter.stats()
+        return stats
+
+    async def stop(self):
+        if self._app_task is not None:
+            self._uvicorn.should_exit = True
+            await self._app_task
+        self._asr_task.cancel()
+        await asyncio.gather(self._asr_task, return_exceptions=True)
+        await self.fake_asr.stop()
+
+
+async def run_benchmark(args):
+    if args.wav:
+        clips = [load_wav(path) for path in args.wav]
+    else:
+        clips = [synthetic_speech(args.speech_seconds)]
+
+    pipeline = args.mode == 'pipeline'
+    stack = None
+    url = args.url
+    if url is None:
+        stack = LocalStack(args)
+        url = await stack.start()
+    if pipeline and args.stream_audio:
+        url += f"{'&' if '?' in url else '?'}stream_audio=1"
+
+    trailing_silence = args.trailing_silence
+    if trailing_silence is None:
+        trailing_silence = args.max_silence + 1.0
+
+    callers = [
+        Caller(i, clips[i % len(clips)], pipeline, args.chunk_ms / 1000, trailing_silence)
+        for i in range(args.callers)
+    ]
+
+    async def start_caller(caller):
+        # Spread connects over the ramp so callers don't run in lockstep.
+        await asyncio.sleep(args.ramp * caller.index / max(1, args.callers))
+        await caller.run(url, args.timeout)
+
+    logger.info(f"Running {args.callers} {args.mode} callers against {url}")
+    started = time.monotonic()
+    try:
+        await asyncio.gather(*(start_caller(caller) for caller in callers))
+        wall_seconds = time.monotonic() - started
+        stand_ins = stack.stats() if stack else None
+    finally:
+        if stack:
+            await stack.stop()
+
+    results = [caller.result() for caller in callers]
+    completed = [r for r in results if r["error"] is None]
+
+    def collect(metric):
+        return [r[metric] for r in completed if r[metric] is not None]
+
+    speech_seconds = sum(r["speech_seconds"] for r in completed)
+    return {
+        "mode": args.mode,
+        "url": url,
+        "local_stand_ins": stack is not None,
+        "config": {key: value for key, value in vars(args).items() if key not in ('output', 'compare')},
+        "host": platform.node(),
+        "python": platform.python_version(),
+        "timestamp": time.time(),
+        "wall_seconds": wall_seconds,
+        "callers": len(results),
+        "completed": len(completed),
+        "errors": [r["error"] for r in results if r["error"] is not None],
+        "throughput": {
+            "calls_per_second": len(completed) / wall_seconds,
+            "speech_seconds_per_second": speech_seconds / wall_seconds,
+        },
+        "latency": {
+            "time_to_first_partial": summarize(collect("time_to_first_partial")),
+            "endpoint_to_final": summarize(collect("endpoint_to_final")),
+            "time_to_first_audio": summarize(collect("time_to_first_audio")),
+            "inter_sentence_gap": summarize([gap for r in completed for gap in r["inter_sentence_gaps"]]),
+            "playback_stall": summarize(collect("playback_stall")),
+        },
+        "stand_ins": stand_ins,
+        "per_caller": results,
+    }
+
+
+def print_report(report, baseline=None):
+    print(f"{report['mode']}: {report['completed']}/{report['callers']} callers completed "
+          f"in {report['wall_seconds']:.1f}s "
+          f"({report['throughput']['calls_per_second']:.2f} calls/s)")
+    for error in sorted(set(report["errors"])):
+        print(f"  error: {error}")
+    for metric, summary in report["latency"].items():
+        if not summary["count"]:
+            continue
+        line = (f"  {metric:<22} p50 {summary['p50_ms']:8.1f}ms  p95 {summary['p95_ms']:8.1f}ms  "
+                f"p99 {summary['p99_ms']:8.1f}ms  (n={summary['count']})")
+        previous = (baseline or {}).get("latency", {}).get(metric, {})
+        if previous.get("count"):
+            line += (f"  vs baseline p50 {summary['p50_ms'] - previous['p50_ms']:+.1f}ms"
+                     f" p95 {summary['p95_ms'] - previous['p95_ms']:+.1f}ms")
+        print(line)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('mode', choices=('asr', 'pipeline'), nargs='?', default='pipeline',
+                        help="benchmark the ASR gateway alone or the full ASR -> LLM -> TTS pipeline")
+    parser.add_argument('--callers', type=int, default=10, help="number of concurrent callers")
+    parser.add_argument('--wav', nargs='*', help="16 kHz mono 16-bit WAV files, assigned to callers round-robin")
+    parser.add_argument('--speech-seconds', type=float, default=3.0, help="length of the synthetic utterance without --wav")
+    parser.add_argument('--chunk-ms', type=int, default=60, help="size of each streamed audio chunk")
+    parser.add_argument('--trailing-silence', type=float, help="silence sent after the speech (default: max silence + 1s)")
+    parser.add_argument('--ramp', type=float, default=1.0, help="seconds over which callers connect")
+    parser.add_argument('--timeout', type=float, default=30.0, help="seconds to wait for a response after the audio is sent")
+    parser.add_argument('--url', help="benchmark a running server at this websocket URL instead of local stand-ins")
+    parser.add_argument('--stream-audio', action='store_true', help="receive TTS audio chunk by chunk as it is synthesized")
+    parser.add_argument('--output', help="write the JSON report here")
+    parser.add_argument('--compare', help="previous JSON report to print deltas against")
+
+    stand_ins = parser.add_argument_group('local stand-ins')
+    stand_ins.add_argument('--asr-latency', type=float, default=0.05, help="fake upstream ASR reply latency")
+    stand_ins.add_argument('--llm-latency', type=float, default=0.3, help="fake LLM time to first token")
+    stand_ins.add_argument('--tts-latency', type=float, default=0.15, help="fake TTS time to first byte")
+    stand_ins.add_argument('--min-silence', type=float, default=0.3, help="gateway silence before a stable transcript ends the utterance")
+    stand_ins.add_argument('--max-silence', type=float, default=1.2, help="gateway silence that always ends the utterance")
+    stand_ins.add_argument('--recognition-mode', choices=('full', 'incremental'), default='full')
+    stand_ins.add_argument('--pool-size', type=int, default=4, help="upstream ASR connection pool size")
+    stand_ins.add_argument('--speculation', choices=('off', 'llm', 'tts'), default='off',
+                           help="start answers on stable partials before the final transcript")
+    stand_ins.add_argument('--segmentation', choices=('sentence', 'latency'), default='latency',
+                           help="how answers are cut into TTS requests")
+    stand_ins.add_argument('--cache', action='store_true', help="keep the answer and audio caches enabled")
+    stand_ins.add_argument('--upstream-port', type=int, default=5100)
+    stand_ins.add_argument('--asr-port', type=int, default=5001)
+    stand_ins.add_argument('--app-port', type=int, default=8001)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(message)s')
+    # Per-frame and per-request logging from the servers would swamp the report.
+    logging.getLogger().setLevel(logging.WARNING)
+    logger.setLevel(logging.INFO)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+
+    report = asyncio.run(run_benchmark(args))
+    print_report(report, baseline)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        logger.info(f"Wrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
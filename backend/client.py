@@ -2,8 +2,16 @@ import asyncio
 import websockets
 import json
 import logging
-import pyaudio
-import queue
+from urllib.parse import urlencode
+
+from backend.metrics import current_trace, span
+
+try:
+    import pyaudio
+except ImportError:
+    # Only needed to stream from a local microphone; the web pipeline
+    # forwards browser audio with send_audio() instead.
+    pyaudio = None
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,30 +21,56 @@ logging.basicConfig(
 logger = logging.getLogger('asr_client')
 
 class ASRClient:
-    def __init__(self, server_url='ws://localhost:5000'):
+    def __init__(self, server_url='ws://localhost:5000', batch_ms=90, max_queued_frames=100, session_id=None,
+                 codec='pcm'):
         self.server_url = server_url
+        # Passed on to the server so its spans share our session ID.
+        self.session_id = session_id
+        # Encoding of what send_audio() forwards; the server decodes it to PCM.
+        self.codec = codec
         self.websocket = None
+        # HTTP status of the last refused connect, e.g. 503 at capacity.
+        self.rejected_status = None
         self.is_connected = False
         self.is_streaming = False
         
         self.sample_rate = 16000
         self.channels = 1
-        self.format = pyaudio.paInt16
         self.chunk_size = 480  
         
-        self.audio = pyaudio.PyAudio()
+        self.audio = None
+        self.stream = None
         
-        self.audio_queue = queue.Queue()
+        # Microphone frames are coalesced into batch_ms of audio per send. The
+        # queue holds at most max_queued_frames; under backpressure the oldest
+        # frames are dropped so what does get sent stays close to real time.
+        self.batch_bytes = int(self.sample_rate * batch_ms / 1000) * 2
+        self.audio_queue = asyncio.Queue(maxsize=max_queued_frames)
+        self.loop = None
+        self.frames_dropped = 0
+        self.batches_sent = 0
         
         self.transcription_callback = None
+        self.partial_callback = None
         
     async def connect(self):
         try:
-            self.websocket = await websockets.connect(self.server_url)
+            params = {}
+            if self.session_id:
+                params['session'] = self.session_id
+            if self.codec != 'pcm':
+                params['codec'] = self.codec
+            url = self.server_url
+            if params:
+                url += f"{'&' if '?' in url else '?'}{urlencode(params)}"
+            self.rejected_status = None
+            self.websocket = await websockets.connect(url)
             self.is_connected = True
-            logger.info(f"Connected to ASR server at {self.server_url}")
+            logger.info(f"Connected to ASR server at {self.server_url} ({self.codec})")
             return True
         except Exception as e:
+            if isinstance(e, websockets.exceptions.InvalidStatus):
+                self.rejected_status = e.response.status_code
             logger.error(f"Failed to connect to ASR server: {e}")
             return False
             
@@ -47,36 +81,69 @@ class ASRClient:
             self.is_connected = False
             logger.info(f"Disconnected from ASR server")
             
+    def enqueue_frame(self, audio_data):
+        if self.audio_queue.full():
+            self.audio_queue.get_nowait()
+            self.frames_dropped += 1
+        self.audio_queue.put_nowait(audio_data)
+            
     def audio_callback(self, in_data, frame_count, time_info, status):
+        # Runs on PyAudio's thread; hand the frame to the event loop.
         if self.is_streaming and self.is_connected:
-            self.audio_queue.put(in_data)
+            self.loop.call_soon_threadsafe(self.enqueue_frame, in_data)
         return (in_data, pyaudio.paContinue)
         
+    async def send_audio(self, audio_data):
+        """Forward audio captured elsewhere, e.g. in the browser: 16 kHz mono
+        16-bit PCM, or one packet per call for a compressed ``codec``."""
+        if not self.is_connected:
+            return False
+        with span('asr_forward'):
+            await self.websocket.send(audio_data)
+        return True
+        
+    def pending_audio_bytes(self):
+        """Bytes handed to the websocket that are still in the socket's write buffer."""
+        if not self.is_connected or self.websocket is None:
+            return 0
+        return self.websocket.transport.get_write_buffer_size()
+
     async def audio_sender(self):
         while self.is_streaming and self.is_connected:
+            batch = bytearray()
+            while len(batch) < self.batch_bytes:
+                audio_data = await self.audio_queue.get()
+                if audio_data is None:
+                    break
+                batch.extend(audio_data)
+            
+            if not batch:
+                continue
             try:
-                try:
-                    audio_data = self.audio_queue.get(block=True, timeout=0.1)
-                except queue.Empty:
-                    continue
-                
-                await self.websocket.send(audio_data)
-                self.audio_queue.task_done()
+                with span('asr_forward'):
+                    await self.websocket.send(bytes(batch))
+                self.batches_sent += 1
             except Exception as e:
                 logger.error(f"Error in audio sender: {e}")
                 if not self.is_connected:
                     break
             
-            await asyncio.sleep(0.001)
-            
     async def start_streaming(self):
         if not self.is_connected:
             logger.error("Not connected to ASR server")
             return False
+
+        if pyaudio is None:
+            logger.error("PyAudio is not installed, cannot stream from the local microphone")
+            return False
+            
+        if self.audio is None:
+            self.audio = pyaudio.PyAudio()
+        self.loop = asyncio.get_running_loop()
             
         # Open audio stream
         self.stream = self.audio.open(
-            format=self.format,
+            format=pyaudio.paInt16,
             channels=self.channels,
             rate=self.sample_rate,
             input=True,
@@ -94,14 +161,27 @@ class ASRClient:
         
     async def stop_streaming(self):
         self.is_streaming = False
+        if self.loop:
+            # Wake the sender so it sees is_streaming and exits.
+            self.enqueue_frame(None)
         
-        if hasattr(self, 'stream') and self.stream:
+        if self.stream:
             self.stream.stop_stream()
             self.stream.close()
-            logger.info("Stopped audio streaming")
+            self.stream = None
+            logger.info(f"Stopped audio streaming ({self.batches_sent} batches sent, {self.frames_dropped} frames dropped)")
+    
+    def terminate_audio(self):
+        if self.audio:
+            self.audio.terminate()
+            self.audio = None
     
     def set_transcription_callback(self, callback):
         self.transcription_callback = callback
+
+    def set_partial_callback(self, callback):
+        """``callback(text, trailing_silence)`` is called, synchronously, for every partial transcript."""
+        self.partial_callback = callback
             
     async def listen_continuously(self):
         if not self.is_connected:
@@ -118,11 +198,18 @@ class ASRClient:
                         current_text = response_json["text"]
                         logger.info(f"Received transcription: {current_text}")
                     
+                    if not response_json.get("reset_session", False) and "text" in response_json:
+                        if self.partial_callback:
+                            self.partial_callback(response_json["text"], response_json.get("trailing_silence", 0.0))
+
                     if response_json.get("reset_session", False) and "text" in response_json:
                         final_text = response_json["text"]
                         logger.info(f"Final transcription received (reset_session=True): {final_text}")
                         
                         if self.transcription_callback:
+                            # The callback's task copies the trace, so the whole
+                            # response is tagged with this utterance.
+                            current_trace.set(response_json.get("utterance_id"))
                             asyncio.create_task(self.transcription_callback(final_text))
                         
                 except json.JSONDecodeError:
@@ -189,7 +276,7 @@ async def continuous_main():
     finally:
         await client.stop_streaming()
         await client.disconnect()
-        client.audio.terminate()
+        client.terminate_audio()
 
 async def single_transcription_main():
     client = ASRClient('ws://localhost:5000')
@@ -213,7 +300,7 @@ async def single_transcription_main():
         # Clean up
         await client.stop_streaming()
         await client.disconnect()
-        client.audio.terminate()
+        client.terminate_audio()
 
 if __name__ == "__main__":
     try:
@@ -0,0 +1,61 @@
+try:
+    import opuslib
+except Exception:
+    # Not installed, or installed without libopus (opuslib raises a plain
+    # Exception then); the gateway only accepts raw PCM in that case.
+    opuslib = None
+
+SAMPLE_RATE = 16000
+
+
+class OpusDecoder:
+    """Decodes 16 kHz mono Opus, one packet (up to 120 ms) per websocket message."""
+
+    __slots__ = ('_decoder', 'max_frame')
+
+    def __init__(self, sample_rate=SAMPLE_RATE):
+        self._decoder = opuslib.Decoder(sample_rate, 1)
+        self.max_frame = sample_rate * 120 // 1000
+
+    def decode(self, packet):
+        return self._decoder.decode(bytes(packet), self.max_frame)
+
+
+# Raw 16-bit PCM needs no decoder.
+DECODERS = {'pcm': None}
+if opuslib is not None:
+    DECODERS['opus'] = OpusDecoder
+
+
+def available_codecs():
+    return sorted(DECODERS)
+
+
+def create_decoder(codec):
+    """A decoder turning ``codec`` messages into PCM, or None for raw PCM."""
+    if codec not in DECODERS:
+        raise ValueError(f"Unsupported codec: {codec}")
+    factory = DECODERS[codec]
+    return factory() if factory is not None else None
+
+
+class CodecCounters:
+    """Gateway-wide ingest volume, to see what compression saves on the wire."""
+
+    __slots__ = ('sessions', 'wire_bytes', 'pcm_bytes', 'decode_errors')
+
+    def __init__(self):
+        self.sessions = {}
+        self.wire_bytes = 0
+        self.pcm_bytes = 0
+        self.decode_errors = 0
+
+    def stats(self):
+        stats = {f"{codec}_sessions": count for codec, count in self.sessions.items()}
+        stats.update({
+            "wire_bytes": self.wire_bytes,
+            "pcm_bytes": self.pcm_bytes,
+            "compression_ratio": self.pcm_bytes / self.wire_bytes if self.wire_bytes else 1.0,
+            "decode_errors": self.decode_errors,
+        })
+        return stats
@@ -0,0 +1,180 @@
+import os
+from collections import deque
+
+ASR_MIN_SILENCE = float(os.getenv('ASR_MIN_SILENCE', '0.3'))
+ASR_MAX_SILENCE = float(os.getenv('ASR_MAX_SILENCE', '1.2'))
+ASR_STABLE_PARTIALS = int(os.getenv('ASR_STABLE_PARTIALS', '2'))
+# How long an ended utterance waits for a transcript covering all of its
+# speech before the final is sent with what there is.
+ASR_FINAL_WAIT = float(os.getenv('ASR_FINAL_WAIT', '1.5'))
+
+# What Endpointer.feed() tells the gateway to do with a frame.
+IDLE = 'idle'      # no utterance in progress, drop the frame
+START = 'start'    # a new utterance starts with this frame
+SPEECH = 'speech'  # speech inside the utterance
+PAUSE = 'pause'    # silence inside the utterance
+FLUSH = 'flush'    # silence; request a partial covering everything so far
+END = 'end'        # the utterance is over, send the final
+
+
+class EndpointCounters:
+    """Gateway-wide endpointing outcomes, shared by every session's Endpointer."""
+
+    __slots__ = ('stable', 'timeout', 'early_cuts', 'stale')
+
+    def __init__(self):
+        self.stable = 0
+        self.timeout = 0
+        self.early_cuts = 0
+        # Finals sent without a transcript of all the speech, because
+        # ASR_FINAL_WAIT ran out first.
+        self.stale = 0
+
+    def stats(self):
+        return {
+            "stable": self.stable,
+            "timeout": self.timeout,
+            "early_cuts": self.early_cuts,
+            "early_cut_rate": self.early_cuts / self.stable if self.stable else 0.0,
+            "stale": self.stale,
+        }
+
+
+class Endpointer:
+    """Decides, frame by frame, when a caller has finished an utterance.
+
+    Silence is counted in audio time, so network jitter does not move the
+    endpoint. An utterance ends early once ``min_silence`` has passed and
+    the last ``stable_partials`` partial transcripts agree, the newest one
+    covering all of the speech, and no transcript commit is outstanding;
+    it always ends after ``max_silence``.
+    While waiting, a partial is requested every ``flush_interval`` so the
+    stability check has fresh transcripts to compare.
+
+    VAD decisions are smoothed: inside trailing silence, speech has to last
+    ``speech_frames`` frames to count, so clicks and breaths don't restart
+    the wait.
+
+    An early end followed by more speech within ``early_cut_window`` is an
+    early cut. Each one makes this session wait longer (up to
+    ``max_silence``); early ends that hold let it relax back towards
+    the configured ``min_silence``.
+    """
+
+    __slots__ = (
+        'counters', 'frame_seconds', 'base_min_silence', 'min_silence', 'max_silence',
+        'stable_partials', 'speech_frames', 'flush_after', 'flush_interval', 'early_cut_window',
+        'active', 'frame', 'speech_run', 'last_speech_frame', 'next_flush_frame',
+        'partials', 'covered_frame', 'last_end_frame', 'last_end_reason'
+    )
+
+    def __init__(self, counters, frame_seconds=0.03, min_silence=ASR_MIN_SILENCE,
+                 max_silence=ASR_MAX_SILENCE, stable_partials=ASR_STABLE_PARTIALS,
+                 speech_frames=3, flush_after=0.1, flush_interval=0.15, early_cut_window=1.0):
+        self.counters = counters
+        self.frame_seconds = frame_seconds
+        self.max_silence = max_silence
+        self.base_min_silence = min(min_silence, max_silence)
+        self.min_silence = self.base_min_silence
+        self.stable_partials = max(1, stable_partials)
+        self.speech_frames = speech_frames
+        self.flush_after = flush_after
+        self.flush_interval = flush_interval
+        self.early_cut_window = early_cut_window
+
+        self.active = False
+        self.frame = 0
+        self.speech_run = 0
+        self.last_speech_frame = 0
+        self.next_flush_frame = 0
+        self.partials = deque(maxlen=self.stable_partials)
+        self.covered_frame = -1
+        self.last_end_frame = None
+        self.last_end_reason = None
+
+    def _frames(self, seconds):
+        return max(1, round(seconds / self.frame_seconds))
+
+    def silence(self):
+        """Seconds of trailing silence in the current utterance."""
+        return (self.frame - self.last_speech_frame) * self.frame_seconds
+
+    def feed(self, is_speech, committing=False):
+        """``committing`` says a transcript commit is still on its way, which rules out a stable end."""
+        self.frame += 1
+        self.speech_run = self.speech_run + 1 if is_speech else 0
+
+        if not self.active:
+            if not is_speech:
+                return IDLE
+            self._start()
+            return START
+
+        # Brief dropouts inside speech keep it going; after a real pause
+        # only a sustained run counts as speech again.
+        if is_speech and (self.speech_run >= self.speech_frames
+                          or self.frame - self.last_speech_frame <= self.speech_frames):
+            self.last_speech_frame = self.frame
+            self.next_flush_frame = self.frame + self._frames(self.flush_after)
+            return SPEECH
+
+        silence = self.silence()
+        if silence >= self.max_silence:
+            return self._end('timeout')
+        if silence >= self.min_silence and not committing and self.is_stable():
+            return self._end('stable')
+        if self.frame >= self.next_flush_frame:
+            self.next_flush_frame = self.frame + self._frames(self.flush_interval)
+            return FLUSH
+        return PAUSE
+
+    def on_partial(self, text, requested_frame):
+        """Record a partial transcript of the audio up to ``requested_frame``.
+
+        Results still count after the utterance ended, while the gateway
+        waits for one covering all of the speech.
+        """
+        self.partials.append(text.strip())
+        self.covered_frame = max(self.covered_frame, requested_frame)
+
+    def covers_speech(self):
+        """Whether a partial covering all of the speech so far has arrived."""
+        return self.covered_frame >= self.last_speech_frame
+
+    def is_stable(self):
+        return (
+            self.covers_speech()
+            and len(self.partials) == self.stable_partials
+            and len(set(self.partials)) == 1
+        )
+
+    def _start(self):
+        if self.last_end_reason == 'stable':
+            if (self.frame - self.last_end_frame) * self.frame_seconds < self.early_cut_window:
+                self.counters.early_cuts += 1
+                self.min_silence = min(self.max_silence, self.min_silence * 1.5)
+            else:
+                self.min_silence = max(self.base_min_silence, self.min_silence * 0.9)
+
+        self.active = True
+        self.last_speech_frame = self.frame
+        self.next_flush_frame = self.frame + self._frames(self.flush_after)
+        self.partials.clear()
+        self.covered_frame = -1
+
+    def _end(self, reason):
+        self.active = False
+        self.last_end_frame = self.frame
+        self.last_end_reason = reason
+        if reason == 'stable':
+            self.counters.stable += 1
+        else:
+            self.counters.timeout += 1
+        return END
+
+    def stats(self):
+        return {
+            "min_silence": self.min_silence,
+            "max_silence": self.max_silence,
+            "last_end_reason": self.last_end_reason,
+        }
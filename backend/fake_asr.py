@@ -0,0 +1,83 @@
+import asyncio
+import json
+import logging
+import struct
+
+import numpy as np
+import websockets
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('fake_asr')
+
+
+class FakeASRServer:
+    """Local stand-in for the upstream GPU ASR websocket.
+
+    Speaks the same protocol as the real service: every binary WAV message
+    gets one JSON reply with a ``text`` field, empty messages are ignored.
+    The transcript is one word per ``seconds_per_word`` of non-silent
+    audio so callers can tell how much speech a reply covered.
+    """
+
+    def __init__(self, host='127.0.0.1', port=5100, latency=0.05, seconds_per_word=0.5, silence_rms=100.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.seconds_per_word = seconds_per_word
+        self.silence_rms = silence_rms
+        self.requests = 0
+        self.bytes_received = 0
+        self.connections = 0
+        self.server = None
+
+    def transcribe(self, wav_data):
+        sample_rate, = struct.unpack('<L', wav_data[24:28])
+        data_length, = struct.unpack('<L', wav_data[40:44])
+        # Like a real recognizer, silence adds no words: only 30 ms frames
+        # with some energy count towards the transcript.
+        frame = int(sample_rate * 0.03)
+        samples = np.frombuffer(wav_data, dtype='<i2', count=data_length // 2, offset=44)
+        frames = samples[:len(samples) // frame * frame].reshape(-1, frame).astype(np.float32)
+        voiced = np.count_nonzero(np.sqrt((frames ** 2).mean(axis=1)) > self.silence_rms)
+        words = int(voiced * 0.03 / self.seconds_per_word)
+        return " ".join(f"w{i}" for i in range(words))
+
+    async def handle(self, websocket):
+        self.connections += 1
+        try:
+            async for message in websocket:
+                if not message:
+                    continue
+                self.requests += 1
+                self.bytes_received += len(message)
+                await asyncio.sleep(self.latency)
+                await websocket.send(json.dumps({"text": self.transcribe(message)}))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def start(self):
+        self.server = await websockets.serve(self.handle, self.host, self.port)
+        logger.info(f"Fake ASR upstream listening at ws://{self.host}:{self.port}")
+        return self.server
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+
+async def serve_forever():
+    server = FakeASRServer()
+    await server.start()
+    await asyncio.Future()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve_forever())
+    except KeyboardInterrupt:
+        logger.info("Fake ASR stopped by user")
@@ -0,0 +1,38 @@
+import asyncio
+
+from backend.llm import LLMBackend
+
+DEFAULT_ANSWER = (
+    "Xin chào, cửa hàng mở cửa từ 8 giờ sáng đến 10 giờ tối. "
+    "Bạn có thể ghé bất cứ ngày nào trong tuần. "
+    "Nếu cần thêm thông tin, hãy gọi cho chúng tôi nhé!"
+)
+
+
+class FakeLLMBackend(LLMBackend):
+    """Local stand-in for Gemini with configurable latency.
+
+    Streams ``answer`` in ``chunk_chars`` sized pieces, waiting
+    ``first_token_latency`` before the first one and ``chunk_delay`` between
+    the rest.
+    """
+
+    def __init__(self, answer=DEFAULT_ANSWER, first_token_latency=0.3, chunk_delay=0.05, chunk_chars=24):
+        self.answer = answer
+        self.first_token_latency = first_token_latency
+        self.chunk_delay = chunk_delay
+        self.chunk_chars = chunk_chars
+        self.requests = 0
+        self.cancelled = 0
+
+    async def stream(self, prompt: str):
+        self.requests += 1
+        try:
+            await asyncio.sleep(self.first_token_latency)
+            for start in range(0, len(self.answer), self.chunk_chars):
+                if start:
+                    await asyncio.sleep(self.chunk_delay)
+                yield self.answer[start:start + self.chunk_chars]
+        except (asyncio.CancelledError, GeneratorExit):
+            self.cancelled += 1
+            raise
@@ -0,0 +1,33 @@
+import asyncio
+
+from backend.synth import TTSBackend
+
+# One silent MPEG-2 Layer III frame: 24 kHz, 48 kbps, mono, 144 bytes, 24 ms.
+# Same format edge-tts returns, so durations come out right downstream.
+MP3_FRAME = bytes((0xFF, 0xF3, 0x64, 0xC0)) + bytes(140)
+MP3_FRAME_SECONDS = 576 / 24000
+
+
+class FakeTTSBackend(TTSBackend):
+    """Local stand-in for edge-tts with configurable latency.
+
+    Produces ``seconds_per_char`` of silent MP3 per character of text. The
+    first chunk arrives after ``first_byte_latency``; the rest is streamed
+    ``realtime_factor`` times faster than its playback duration.
+    """
+
+    def __init__(self, first_byte_latency=0.15, seconds_per_char=0.06, realtime_factor=10.0, chunk_frames=10):
+        self.first_byte_latency = first_byte_latency
+        self.seconds_per_char = seconds_per_char
+        self.realtime_factor = realtime_factor
+        self.chunk_frames = chunk_frames
+        self.requests = 0
+
+    async def stream(self, text: str, voice: str):
+        self.requests += 1
+        frames = max(1, int(len(text) * self.seconds_per_char / MP3_FRAME_SECONDS))
+        await asyncio.sleep(self.first_byte_latency)
+        for start in range(0, frames, self.chunk_frames):
+            if start:
+                await asyncio.sleep(self.chunk_frames * MP3_FRAME_SECONDS / self.realtime_factor)
+            yield MP3_FRAME * min(self.chunk_frames, frames - start)
@@ -0,0 +1,351 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import multiprocessing
+from multiprocessing.connection import wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from backend.metrics import REGISTRY, merge_snapshots, render_snapshot
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s [%(levelname)s] %(message)s',
+    handlers=[logging.StreamHandler()]
+)
+logger = logging.getLogger('asr_gateway')
+
+ASR_STATS_PORT = int(os.getenv('ASR_STATS_PORT', '5050'))
+
+
+def bind_socket(host, port, reuse_port):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    if reuse_port:
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    sock.bind((host, port))
+    sock.listen(1024)
+    return sock
+
+
+def sum_counts(reports):
+    """Add up the integer fields of several (nested) stats dicts."""
+    totals = {}
+    for report in reports:
+        for key, value in report.items():
+            if isinstance(value, dict):
+                totals[key] = sum_counts([totals.get(key, {}), value])
+            elif isinstance(value, int) and not isinstance(value, bool):
+                totals[key] = totals.get(key, 0) + value
+    return totals
+
+
+def run_worker(index, host, port, sock, server_kwargs, conn, report_interval):
+    """Entry point of a worker process."""
+    from backend.asr import ASRWebSocketServer
+
+    # Ctrl+C reaches the whole process group; only the supervisor acts on it
+    # and then drains the workers with SIGTERM.
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    if sock is None:
+        sock = bind_socket(host, port, reuse_port=True)
+
+    server = ASRWebSocketServer(host, port, **server_kwargs)
+    logger.info(f"Worker {index} (pid {os.getpid()}) starting")
+    asyncio.run(_serve_worker(server, sock, conn, report_interval))
+    logger.info(f"Worker {index} (pid {os.getpid()}) exited")
+
+
+async def _serve_worker(server, sock, conn, report_interval):
+    async def report():
+        # Doubles as the heartbeat: a worker whose event loop is stuck stops
+        # reporting and gets restarted by the supervisor.
+        while True:
+            try:
+                conn.send({
+                    "stats": server.stats(),
+                    "metrics": REGISTRY.snapshot(),
+                    "draining": server.draining,
+                })
+            except OSError:
+                logger.warning("Supervisor went away, draining")
+                await server.drain()
+                return
+            await asyncio.sleep(report_interval)
+
+    reporter = asyncio.create_task(report())
+    try:
+        await server.start_server(sock=sock, drain_on_sigterm=True)
+    finally:
+        reporter.cancel()
+        conn.close()
+
+
+class _Worker:
+    __slots__ = ('index', 'process', 'conn', 'started_at', 'drain_started_at', 'last_report_at', 'report')
+
+    def __init__(self, index, process, conn):
+        self.index = index
+        self.process = process
+        self.conn = conn
+        self.started_at = time.monotonic()
+        self.drain_started_at = None
+        self.last_report_at = None
+        self.report = None
+
+
+class GatewaySupervisor:
+    """Runs ``workers`` ASR gateway processes on one port and keeps them healthy.
+
+    With SO_REUSEPORT every worker binds its own socket and the kernel
+    spreads connections across them; otherwise the supervisor binds the
+    socket once and hands it to each worker. Workers that exit or stop
+    reporting for ``heartbeat_timeout`` seconds are replaced. SIGHUP
+    restarts the workers one at a time, starting each replacement before
+    draining the old worker, and SIGTERM or Ctrl+C drains them all and
+    exits. Aggregated stats are served on ``stats_port`` as /metrics
+    (Prometheus) and /stats (JSON).
+    """
+
+    def __init__(self, workers, host='0.0.0.0', port=5000, server_kwargs=None,
+                 stats_port=ASR_STATS_PORT, drain_timeout=30.0, reuse_port=None,
+                 report_interval=1.0, heartbeat_timeout=10.0):
+        self.workers = workers
+        self.host = host
+        self.port = port
+        self.server_kwargs = server_kwargs or {}
+        self.stats_port = stats_port
+        self.drain_timeout = drain_timeout
+        self.reuse_port = hasattr(socket, 'SO_REUSEPORT') if reuse_port is None else reuse_port
+        self.report_interval = report_interval
+        self.heartbeat_timeout = heartbeat_timeout
+
+        self.context = multiprocessing.get_context('spawn')
+        self.sock = None
+        self.slots = [None] * workers
+        self.draining = []
+        self.next_start = [0.0] * workers
+        self.crashes = [0] * workers
+
+        # Histograms of workers that have exited, so totals never go backwards.
+        self.retired_metrics = {"histograms": {}, "gauges": {}}
+
+        self.stopping = False
+        self.restart_requested = False
+        self.restarts = 0
+        self.stats_server = None
+
+    def _spawn(self, index):
+        receiver, sender = self.context.Pipe(duplex=False)
+        process = self.context.Process(
+            target=run_worker,
+            args=(index, self.host, self.port, self.sock, self.server_kwargs, sender, self.report_interval),
+            name=f"asr-worker-{index}",
+            daemon=False
+        )
+        process.start()
+        sender.close()
+        logger.info(f"Started worker {index} (pid {process.pid})")
+        return _Worker(index, process, receiver)
+
+    def _collect_reports(self, timeout, extra=()):
+        workers = {
+            w.conn: w for w in self.slots + self.draining + list(extra)
+            if w is not None and w.conn is not None
+        }
+        if not workers:
+            time.sleep(timeout)
+            return
+        for conn in wait(list(workers), timeout):
+            worker = workers[conn]
+            try:
+                while conn.poll():
+                    worker.report = conn.recv()
+                    worker.last_report_at = time.monotonic()
+            except (EOFError, OSError):
+                # The worker exited; _check_workers notices and replaces it.
+                conn.close()
+                worker.conn = None
+
+    def _retire(self, worker):
+        worker.process.join(timeout=0)
+        if worker.conn is not None:
+            worker.conn.close()
+        if worker.report is not None:
+            self.retired_metrics = merge_snapshots({
+                "retired": self.retired_metrics,
+                "last": {"histograms": worker.report["metrics"]["histograms"], "gauges": {}},
+            })
+
+    def _check_workers(self):
+        now = time.monotonic()
+        for index, worker in enumerate(self.slots):
+            if worker is not None and not worker.process.is_alive():
+                logger.warning(f"Worker {index} (pid {worker.process.pid}) exited with code {worker.process.exitcode}")
+                self._retire(worker)
+                self.slots[index] = None
+                # Back off when a worker keeps dying right after it starts.
+                if now - worker.started_at < 5.0:
+                    self.crashes[index] += 1
+                else:
+                    self.crashes[index] = 0
+                self.next_start[index] = now + min(30.0, 0.5 * 2 ** self.crashes[index])
+                self.restarts += 1
+            elif worker is not None:
+                last_seen = worker.last_report_at or worker.started_at
+                if now - last_seen > self.heartbeat_timeout:
+                    logger.error(f"Worker {index} (pid {worker.process.pid}) missed heartbeats for "
+                                 f"{now - last_seen:.1f}s, killing it")
+                    worker.process.kill()
+
+            if self.slots[index] is None and now >= self.next_start[index] and not self.stopping:
+                self.slots[index] = self._spawn(index)
+
+        for worker in list(self.draining):
+            if not worker.process.is_alive():
+                logger.info(f"Drained worker {worker.index} (pid {worker.process.pid}) exited")
+                self._retire(worker)
+                self.draining.remove(worker)
+            elif now - worker.drain_started_at > self.drain_timeout + 10.0:
+                logger.warning(f"Worker {worker.index} (pid {worker.process.pid}) did not drain in time, killing it")
+                worker.process.kill()
+
+    def _drain(self, worker):
+        logger.info(f"Draining worker {worker.index} (pid {worker.process.pid})")
+        worker.process.terminate()
+        worker.drain_started_at = time.monotonic()
+        self.draining.append(worker)
+
+    def _rolling_restart(self):
+        self.restart_requested = False
+        logger.info("Rolling restart of all workers")
+        for index, old in enumerate(self.slots):
+            if self.stopping:
+                return
+            new = self._spawn(index)
+            deadline = time.monotonic() + self.heartbeat_timeout
+            while new.last_report_at is None and new.process.is_alive() and time.monotonic() < deadline:
+                self._collect_reports(0.2, extra=(new,))
+            self.slots[index] = new
+            if old is not None:
+                self._drain(old)
+            self.restarts += 1
+
+    def metrics_snapshot(self):
+        active = {
+            str(worker.index): worker.report["metrics"]
+            for worker in self.slots if worker is not None and worker.report is not None
+        }
+        draining = {
+            f"draining-{worker.process.pid}": {"histograms": worker.report["metrics"]["histograms"], "gauges": {}}
+            for worker in self.draining if worker.report is not None
+        }
+        snapshot = merge_snapshots({**active, **draining, "retired": self.retired_metrics})
+        snapshot["gauges"]["asr_gateway_workers"] = {
+            "help": "Live ASR gateway worker processes.",
+            "samples": {"": sum(1 for w in self.slots if w is not None and w.process.is_alive())},
+        }
+        snapshot["gauges"]["asr_gateway_draining_workers"] = {
+            "help": "Worker processes still draining after a restart.",
+            "samples": {"": len(self.draining)},
+        }
+        snapshot["gauges"]["asr_gateway_restarts"] = {
+            "help": "Worker processes replaced since the gateway started.",
+            "samples": {"": self.restarts},
+        }
+        return snapshot
+
+    def stats(self):
+        now = time.monotonic()
+        workers = []
+        for worker in self.slots + self.draining:
+            if worker is None:
+                continue
+            report = worker.report or {}
+            workers.append({
+                "index": worker.index,
+                "pid": worker.process.pid,
+                "alive": worker.process.is_alive(),
+                "draining": worker in self.draining or report.get("draining", False),
+                "last_report_age": now - worker.last_report_at if worker.last_report_at else None,
+                "stats": report.get("stats"),
+            })
+        return {
+            "workers": workers,
+            "restarts": self.restarts,
+            "totals": sum_counts([w["stats"] for w in workers if w["stats"]]),
+        }
+
+    def _start_stats_server(self):
+        supervisor = self
+
+        class StatsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path == '/metrics':
+                    body = render_snapshot(supervisor.metrics_snapshot()).encode()
+                    content_type = 'text/plain; version=0.0.4'
+                elif self.path == '/stats':
+                    body = json.dumps(supervisor.stats()).encode()
+                    content_type = 'application/json'
+                else:
+                    self.send_error(404)
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', content_type)
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.stats_server = ThreadingHTTPServer((self.host, self.stats_port), StatsHandler)
+        threading.Thread(target=self.stats_server.serve_forever, daemon=True).start()
+        logger.info(f"Gateway stats at http://{self.host}:{self.stats_port}/metrics and /stats")
+
+    def _on_stop(self, signum, frame):
+        self.stopping = True
+
+    def _on_restart(self, signum, frame):
+        self.restart_requested = True
+
+    def run(self):
+        if not self.reuse_port:
+            self.sock = bind_socket(self.host, self.port, reuse_port=False)
+
+        signal.signal(signal.SIGTERM, self._on_stop)
+        signal.signal(signal.SIGINT, self._on_stop)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self._on_restart)
+
+        self._start_stats_server()
+        mode = "SO_REUSEPORT" if self.reuse_port else "a shared socket"
+        logger.info(f"Starting {self.workers} ASR gateway workers on ws://{self.host}:{self.port} using {mode}")
+
+        try:
+            while not self.stopping:
+                self._check_workers()
+                self._collect_reports(self.report_interval / 2)
+                if self.restart_requested:
+                    self._rolling_restart()
+        finally:
+            self.shutdown()
+
+    def shutdown(self):
+        logger.info("Draining all workers")
+        for index, worker in enumerate(self.slots):
+            if worker is not None:
+                self._drain(worker)
+                self.slots[index] = None
+        while self.draining:
+            self._collect_reports(0.2)
+            self._check_workers()
+        if self.stats_server is not None:
+            self.stats_server.shutdown()
+        if self.sock is not None:
+            self.sock.close()
+        logger.info("Gateway stopped")
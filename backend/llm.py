@@ -0,0 +1,69 @@
+import os
+import logging
+from contextlib import aclosing
+
+from google import genai
+
+logger = logging.getLogger('llm')
+
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'gemini')
+GEMINI_MODEL = os.getenv('GEMINI_MODEL', 'gemini-2.0-flash-001')
+
+
+class LLMBackend:
+    """Something that streams a text answer for a prompt.
+
+    ``stream`` is an async generator of text chunks. Closing it (or cancelling
+    the task iterating it) must abandon the underlying request.
+    """
+
+    async def stream(self, prompt: str):
+        raise NotImplementedError
+        yield
+
+
+class GeminiBackend(LLMBackend):
+    def __init__(self, model=GEMINI_MODEL, api_key=None):
+        self.model = model
+        self.api_key = api_key
+        self._client = None
+
+    @property
+    def client(self):
+        # One client per process: it owns the HTTP connection pool.
+        if self._client is None:
+            self._client = genai.Client(api_key=self.api_key or os.getenv('GOOGLE_API_KEY'), vertexai=False)
+        return self._client
+
+    async def stream(self, prompt: str):
+        response = await self.client.aio.models.generate_content_stream(model=self.model, contents=prompt)
+        async with aclosing(response) as chunks:
+            async for chunk in chunks:
+                if chunk.text:
+                    yield chunk.text
+
+
+_backend = None
+
+
+def create_llm_backend(name: str):
+    if name == 'gemini':
+        return GeminiBackend()
+    if name == 'fake':
+        from backend.fake_llm import FakeLLMBackend
+        return FakeLLMBackend()
+    raise ValueError(f"Unknown LLM backend: {name}")
+
+
+def get_llm_backend():
+    global _backend
+    if _backend is None:
+        _backend = create_llm_backend(LLM_BACKEND)
+        logger.info(f"Using LLM backend: {type(_backend).__name__}")
+    return _backend
+
+
+def set_llm_backend(backend):
+    """Replace the process-wide backend, e.g. with a fake in tests and benchmarks."""
+    global _backend
+    _backend = backend
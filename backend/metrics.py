@@ -0,0 +1,181 @@
+import bisect
+import logging
+import secrets
+import time
+from contextvars import ContextVar
+
+logger = logging.getLogger('metrics')
+
+# Seconds; spans range from sub-millisecond VAD work to multi-second LLM answers.
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Session/utterance ID of the work running in the current task. Tasks copy
+# it when they are created, so setting it once before dispatching a
+# response tags every span the response goes on to record.
+current_trace = ContextVar('current_trace', default=None)
+
+
+def new_session_id():
+    return secrets.token_hex(6)
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+
+class Histogram:
+    """Cumulative-bucket histogram with a single label, rendered Prometheus-style."""
+
+    def __init__(self, name, help, label, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.label = label
+        self.buckets = tuple(buckets)
+        self._series = {}
+
+    def observe(self, label_value, value):
+        series = self._series.get(label_value)
+        if series is None:
+            # One count per bucket plus +Inf, then the running sum.
+            series = self._series[label_value] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def snapshot(self):
+        return {
+            "help": self.help,
+            "label": self.label,
+            "buckets": self.buckets,
+            "series": {label_value: list(series) for label_value, series in self._series.items()},
+        }
+
+
+class Registry:
+    """Histograms that are updated in place, plus gauges read at scrape time.
+
+    Gauges are callables, so the numbers come straight from the objects that
+    own them (pools, schedulers, caches) and cost nothing between scrapes.
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._gauges = {}
+
+    def histogram(self, name, help, label, buckets=LATENCY_BUCKETS):
+        if name not in self._histograms:
+            self._histograms[name] = Histogram(name, help, label, buckets)
+        return self._histograms[name]
+
+    def gauge(self, name, help, read):
+        """Register ``read()`` as gauge ``name``, replacing any previous one."""
+        self._gauges[name] = (help, read)
+
+    def stats_gauges(self, prefix, help, stats):
+        """Export every numeric field of the dict returned by ``stats()`` as ``<prefix>_<field>``."""
+        self._gauges[prefix] = (help, stats)
+
+    def snapshot(self):
+        """Current values as plain data, picklable and mergeable across processes."""
+        gauges = {}
+        for name, (help, read) in self._gauges.items():
+            try:
+                value = read()
+            except Exception as e:
+                logger.warning(f"Skipping gauge {name}: {e}")
+                continue
+            values = value.items() if isinstance(value, dict) else [(None, value)]
+            for field, number in values:
+                if isinstance(number, bool) or not isinstance(number, (int, float)):
+                    continue
+                metric = f"{name}_{field}" if field else name
+                gauges[metric] = {"help": help, "samples": {"": number}}
+        return {
+            "histograms": {name: histogram.snapshot() for name, histogram in self._histograms.items()},
+            "gauges": gauges,
+        }
+
+    def render(self):
+        return render_snapshot(self.snapshot())
+
+
+def merge_snapshots(snapshots):
+    """Sum histograms across processes; keep gauges apart under a ``worker`` label.
+
+    ``snapshots`` maps a worker name to that worker's ``Registry.snapshot()``.
+    """
+    histograms = {}
+    gauges = {}
+    for worker, snapshot in snapshots.items():
+        for name, histogram in snapshot["histograms"].items():
+            merged = histograms.setdefault(name, {**histogram, "series": {}})
+            for label_value, series in histogram["series"].items():
+                total = merged["series"].get(label_value)
+                merged["series"][label_value] = (
+                    list(series) if total is None else [a + b for a, b in zip(total, series)]
+                )
+        for metric, gauge in snapshot["gauges"].items():
+            merged = gauges.setdefault(metric, {"help": gauge["help"], "samples": {}})
+            for labels, value in gauge["samples"].items():
+                worker_label = f'worker="{worker}"'
+                merged["samples"][f"{worker_label},{labels}" if labels else worker_label] = value
+    return {"histograms": histograms, "gauges": gauges}
+
+
+def render_snapshot(snapshot):
+    """Prometheus text exposition format."""
+    lines = []
+    for name, histogram in snapshot["histograms"].items():
+        lines.append(f"# HELP {name} {histogram['help']}")
+        lines.append(f"# TYPE {name} histogram")
+        bounds = tuple(histogram["buckets"]) + (float('inf'),)
+        for label_value, series in sorted(histogram["series"].items()):
+            labels = f'{histogram["label"]}="{label_value}"'
+            cumulative = 0
+            for bound, count in zip(bounds, series):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{labels},le="{_format_value(bound)}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{labels}}} {series[-1]!r}")
+            lines.append(f"{name}_count{{{labels}}} {cumulative}")
+    for metric, gauge in snapshot["gauges"].items():
+        lines.append(f"# HELP {metric} {gauge['help']}")
+        lines.append(f"# TYPE {metric} gauge")
+        for labels, value in gauge["samples"].items():
+            labels = f"{{{labels}}}" if labels else ""
+            lines.append(f"{metric}{labels} {_format_value(float(value))}")
+    return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    'voice_stage_seconds',
+    'Time spent in each stage of the voice pipeline.',
+    'stage'
+)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.observe(stage, seconds)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f"[{current_trace.get()}] {stage} took {seconds * 1000:.1f}ms")
+
+
+class span:
+    """Times a ``with`` block into the stage histogram."""
+
+    __slots__ = ('stage', 'start')
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.stage, time.perf_counter() - self.start)
+        return False
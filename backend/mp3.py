@@ -0,0 +1,84 @@
+_BITRATES = {
+    # (MPEG-1?, layer) -> kbps by bitrate index
+    (True, 1): (0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448),
+    (True, 2): (0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384),
+    (True, 3): (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    (False, 1): (0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256),
+    (False, 2): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+    (False, 3): (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+
+_SAMPLE_RATES = {
+    3: (44100, 48000, 32000),  # MPEG-1
+    2: (22050, 24000, 16000),  # MPEG-2
+    0: (11025, 12000, 8000),   # MPEG-2.5
+}
+
+
+def _skip_id3(data):
+    if len(data) >= 10 and data[:3] == b'ID3':
+        size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+        footer = 10 if data[5] & 0x10 else 0
+        return 10 + size + footer
+    return 0
+
+
+def parse_frame_header(data, offset):
+    """Return ``(frame_length, samples, sample_rate)`` for the MPEG audio frame
+    at ``offset``, or ``None`` if there is no valid header there."""
+    if offset + 4 > len(data) or data[offset] != 0xFF or data[offset + 1] & 0xE0 != 0xE0:
+        return None
+
+    b1, b2 = data[offset + 1], data[offset + 2]
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+
+def mp3_duration(data):
+    """Duration of an MP3 stream in seconds, from its frame headers alone.
+
+    Walks the frame headers without decoding anything. A leading Xing/Info
+    frame only carries metadata and is not counted. Bytes that don't parse
+    as a frame are skipped one at a time until the next sync word.
+    """
+    offset = _skip_id3(data)
+    duration = 0.0
+    first = True
+    end = len(data)
+
+    while offset + 4 <= end:
+        header = parse_frame_header(data, offset)
+        if header is None:
+            offset += 1
+            continue
+
+        frame_length, samples, sample_rate = header
+        if offset + frame_length > end:
+            break
+
+        if first:
+            first = False
+            frame = data[offset:offset + min(frame_length, 64)]
+            if b'Xing' in frame or b'Info' in frame:
+                offset += frame_length
+                continue
+
+        duration += samples / sample_rate
+        offset += frame_length
+
+    return duration
@@ -0,0 +1,226 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import deque
+
+from backend.metrics import observe, span
+
+logger = logging.getLogger('full_pipeline')
+
+OUTBOUND_MAX_BYTES = int(os.getenv('OUTBOUND_MAX_BYTES', str(1024 * 1024)))
+
+# Send priorities, highest first. Control and status messages overtake
+# audio; partial transcripts only go out when nothing else is waiting.
+CONTROL = 0
+AUDIO = 1
+PARTIAL = 2
+
+
+class OutboundCounters:
+    """Process-wide totals over every connection's OutboundQueue."""
+
+    __slots__ = ('sent', 'bytes_sent', 'coalesced', 'dropped', 'dropped_bytes', 'audio_skipped')
+
+    def __init__(self):
+        self.sent = 0
+        self.bytes_sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.dropped_bytes = 0
+        self.audio_skipped = 0
+
+    def stats(self):
+        return {
+            "sent": self.sent,
+            "bytes_sent": self.bytes_sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "dropped_bytes": self.dropped_bytes,
+            "audio_skipped": self.audio_skipped,
+        }
+
+
+counters = OutboundCounters()
+
+
+class OutboundQueue:
+    """Everything sent to one browser connection, written by a single task.
+
+    Producers enqueue without waiting, so a slow client never stalls the
+    response that is being generated for it. Messages go out by priority,
+    in order within a priority. A new partial transcript replaces any that
+    are still queued.
+
+    Once more than ``max_bytes`` are queued, queued partials are dropped
+    first. If that is not enough, the rest of the current response's audio
+    is skipped: audio already queued is dropped, ``skip_message`` is sent
+    as a control message so the client can flush what it has, and further
+    audio is dropped until ``resume_audio()``. Single audio frames are
+    never dropped on their own, since streamed chunks of one sentence only
+    play back as a whole. Control messages are always kept.
+    """
+
+    def __init__(self, send_text, send_bytes, max_bytes=OUTBOUND_MAX_BYTES, skip_message=None):
+        self._send_text = send_text
+        self._send_bytes = send_bytes
+        self.max_bytes = max_bytes
+        self.skip_message = skip_message
+        self.skipping_audio = False
+        self.queues = (deque(), deque(), deque())
+        self.queued_bytes = 0
+        self.closed = False
+        self.writer = None
+        self._ready = asyncio.Event()
+        self._empty = asyncio.Event()
+        self._empty.set()
+
+        self.sent = 0
+        self.coalesced = 0
+        self.dropped = 0
+        self.audio_skipped = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def start(self):
+        self.writer = asyncio.create_task(self._write())
+
+    def _put(self, priority, payload):
+        if self.closed:
+            return
+        # Text is sized as the UTF-8 that goes on the wire, not in characters.
+        size = len(payload.encode()) if isinstance(payload, str) else len(payload)
+        self.queues[priority].append((payload, size, time.perf_counter()))
+        self.queued_bytes += size
+        if self.queued_bytes > self.max_bytes:
+            self._shed()
+        self._empty.clear()
+        self._ready.set()
+
+    def _drop(self, priority):
+        _, size, _ = self.queues[priority].popleft()
+        self.queued_bytes -= size
+        return size
+
+    def _count_dropped(self, size):
+        counters.dropped_bytes += size
+        counters.dropped += 1
+        self.dropped += 1
+
+    def _shed(self):
+        queue = self.queues[PARTIAL]
+        while queue and self.queued_bytes > self.max_bytes:
+            self._count_dropped(self._drop(PARTIAL))
+        if self.queued_bytes <= self.max_bytes or self.skipping_audio:
+            return
+
+        logger.warning(f"Client is more than {self.max_bytes} bytes behind, skipping the rest of the response's audio")
+        self.skipping_audio = True
+        self.audio_skipped += 1
+        counters.audio_skipped += 1
+        # Messages queued in order with the audio, like the end of the
+        # response, still go out.
+        kept = deque()
+        for item in self.queues[AUDIO]:
+            payload, size, _ = item
+            if isinstance(payload, str):
+                kept.append(item)
+            else:
+                self.queued_bytes -= size
+                self._count_dropped(size)
+        self.queues = (self.queues[CONTROL], kept, self.queues[PARTIAL])
+        if self.skip_message is not None:
+            self.send_json(self.skip_message)
+
+    def send_json(self, message, priority=CONTROL):
+        self._put(priority, json.dumps(message, separators=(",", ":"), ensure_ascii=False))
+
+    def send_bytes(self, data, priority=AUDIO):
+        if priority == AUDIO and self.skipping_audio:
+            self._count_dropped(len(data))
+            return
+        self._put(priority, data)
+
+    def resume_audio(self):
+        """Accept audio again after it was skipped; called when the next response starts."""
+        self.skipping_audio = False
+
+    def send_partial(self, message):
+        """Queue a partial transcript in place of any older one still waiting."""
+        queue = self.queues[PARTIAL]
+        while queue:
+            self._drop(PARTIAL)
+            counters.coalesced += 1
+            self.coalesced += 1
+        self.send_json(message, PARTIAL)
+
+    def discard(self, priority):
+        """Drop everything queued at ``priority``, e.g. the audio of an interrupted response."""
+        queue = self.queues[priority]
+        while queue:
+            self._drop(priority)
+
+    def _next(self):
+        for queue in self.queues:
+            if queue:
+                item = queue.popleft()
+                self.queued_bytes -= item[1]
+                return item
+        return None
+
+    async def _write(self):
+        try:
+            while True:
+                item = self._next()
+                if item is None:
+                    self._empty.set()
+                    self._ready.clear()
+                    await self._ready.wait()
+                    continue
+
+                payload, size, queued_at = item
+                with span('ws_send'):
+                    if isinstance(payload, str):
+                        await self._send_text(payload)
+                    else:
+                        await self._send_bytes(payload)
+                latency = time.perf_counter() - queued_at
+                observe('ws_outbound', latency)
+                self.sent += 1
+                self.latency_total += latency
+                self.latency_max = max(self.latency_max, latency)
+                counters.sent += 1
+                counters.bytes_sent += size
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            # The connection is gone; the receive side notices and cleans up.
+            logger.info(f"Stopped sending to client: {e}")
+        finally:
+            self.closed = True
+            self._empty.set()
+
+    async def close(self, timeout=1.0):
+        """Give what is queued ``timeout`` seconds to go out, then stop the writer."""
+        if self.writer is None:
+            return
+        try:
+            await asyncio.wait_for(self._empty.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self.closed = True
+        self.writer.cancel()
+        await asyncio.gather(self.writer, return_exceptions=True)
+
+    def stats(self):
+        return {
+            "queued_messages": sum(len(queue) for queue in self.queues),
+            "queued_bytes": self.queued_bytes,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "dropped": self.dropped,
+            "audio_skipped": self.audio_skipped,
+            "send_latency_avg_ms": 1000.0 * self.latency_total / self.sent if self.sent else 0.0,
+            "send_latency_max_ms": 1000.0 * self.latency_max,
+        }
@@ -0,0 +1,67 @@
+import asyncio
+import logging
+
+logger = logging.getLogger('full_pipeline')
+
+
+class ResponsePipeline:
+    """Owns the one response being generated for a connection.
+
+    Starting a new response, or an explicit interrupt, cancels the running
+    one: its LLM stream, pending syntheses and unsent audio go with the
+    task. The browser is then told to flush whatever it still has queued.
+    """
+
+    def __init__(self, send_control):
+        self.send_control = send_control
+        self.task = None
+        self._lock = asyncio.Lock()
+
+        self.responses = 0
+        self.interruptions = 0
+
+    @property
+    def active(self):
+        return self.task is not None and not self.task.done()
+
+    async def _cancel(self):
+        task, self.task = self.task, None
+        if task is None or task.done():
+            return False
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            logger.error(f"Response task failed while being cancelled: {e}")
+        return True
+
+    async def _interrupt(self, reason):
+        if await self._cancel():
+            self.interruptions += 1
+            logger.info(f"Interrupted running response: {reason}")
+        if self.responses:
+            await self.send_control({"type": "interrupt", "data": reason})
+
+    async def interrupt(self, reason):
+        async with self._lock:
+            await self._interrupt(reason)
+
+    async def start(self, respond, *args):
+        """Interrupt whatever is running, then run ``respond(*args)`` as the new response."""
+        async with self._lock:
+            await self._interrupt("new utterance")
+            self.responses += 1
+            self.task = asyncio.create_task(respond(*args))
+
+    async def close(self):
+        async with self._lock:
+            await self._cancel()
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "responses": self.responses,
+            "interruptions": self.interruptions,
+        }
@@ -0,0 +1,51 @@
+import struct
+
+# Binary websocket frames sent to the browser on /asr-tts-full-pipeline.
+# Every frame starts with a one-byte kind followed by a fixed header:
+#
+#   TTS_AUDIO:       kind (u8) | seq (u32) | duration (f32) | text length (u16) | text (utf-8) | audio
+#   TTS_AUDIO_CHUNK: kind (u8) | seq (u32) | part (u16) | final (u8) | duration (f32)
+#                    | text length (u16) | text (utf-8) | audio
+#
+# TTS_AUDIO carries a whole sentence. When audio is streamed, a sentence
+# is instead sent as TTS_AUDIO_CHUNK frames numbered by part; only part 0
+# carries the text, and the final one has no audio and carries the
+# duration. All integers are little-endian. JSON text frames are still
+# used for control and status messages.
+TTS_AUDIO = 1
+TTS_AUDIO_CHUNK = 2
+
+TTS_AUDIO_HEADER = struct.Struct('<BIfH')
+TTS_AUDIO_CHUNK_HEADER = struct.Struct('<BIHBfH')
+
+
+def pack_tts_audio(seq, text, duration, audio):
+    text_bytes = text.encode('utf-8')
+    header = TTS_AUDIO_HEADER.pack(TTS_AUDIO, seq, duration, len(text_bytes))
+    return b''.join((header, text_bytes, audio))
+
+
+def unpack_tts_audio(frame):
+    """Inverse of ``pack_tts_audio``; returns ``(seq, text, duration, audio)``."""
+    kind, seq, duration, text_length = TTS_AUDIO_HEADER.unpack_from(frame)
+    if kind != TTS_AUDIO:
+        raise ValueError(f"Not a TTS audio frame: kind {kind}")
+    start = TTS_AUDIO_HEADER.size
+    text = bytes(frame[start:start + text_length]).decode('utf-8')
+    return seq, text, duration, frame[start + text_length:]
+
+
+def pack_tts_chunk(seq, part, final, text, duration, audio):
+    text_bytes = text.encode('utf-8') if part == 0 else b''
+    header = TTS_AUDIO_CHUNK_HEADER.pack(TTS_AUDIO_CHUNK, seq, part, final, duration, len(text_bytes))
+    return b''.join((header, text_bytes, audio))
+
+
+def unpack_tts_chunk(frame):
+    """Inverse of ``pack_tts_chunk``; returns ``(seq, part, final, text, duration, audio)``."""
+    kind, seq, part, final, duration, text_length = TTS_AUDIO_CHUNK_HEADER.unpack_from(frame)
+    if kind != TTS_AUDIO_CHUNK:
+        raise ValueError(f"Not a TTS audio chunk frame: kind {kind}")
+    start = TTS_AUDIO_CHUNK_HEADER.size
+    text = bytes(frame[start:start + text_length]).decode('utf-8')
+    return seq, part, bool(final), text, duration, frame[start + text_length:]
@@ -0,0 +1,142 @@
+import asyncio
+import logging
+from collections import deque
+
+logger = logging.getLogger('asr_scheduler')
+
+
+class _Lane:
+    __slots__ = ('next_seq', 'delivered_seq', 'epoch', 'waiting', 'tasks', 'lock')
+
+    def __init__(self):
+        self.next_seq = 0
+        self.delivered_seq = -1
+        self.epoch = 0
+        self.waiting = deque()
+        self.tasks = set()
+        self.lock = asyncio.Lock()
+
+
+class PartialScheduler:
+    """Runs upstream recognition requests for every client on the server loop.
+
+    At most ``max_concurrency`` requests are on the wire at once. Each client
+    has a lane with its own sequence numbers: a newer partial cancels the
+    older ones still waiting for an upstream slot, and a result is only
+    delivered if nothing newer has been delivered to that client yet.
+    Requests that aren't supersedable (transcript commits) always run and
+    are always delivered.
+
+    With ``max_waiting``, at most that many partials wait for a slot across
+    all clients; beyond that the oldest waiting partial, the stalest one, is
+    shed to make room.
+    """
+
+    def __init__(self, max_concurrency=4, max_waiting=None):
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self.lanes = {}
+        # Waiting partials of every lane, oldest first.
+        self._waiting = {}
+
+        self.in_flight = 0
+        self.submitted = 0
+        self.delivered = 0
+        self.cancelled = 0
+        self.dropped = 0
+        self.failed = 0
+        self.shed = 0
+
+    def _cancel_waiting(self, lane, task):
+        lane.waiting.remove(task)
+        del self._waiting[task]
+        task.cancel()
+
+    def submit(self, client_id, request, deliver, supersedable=True):
+        """Schedule ``await request()`` and then ``await deliver(result)``."""
+        lane = self.lanes.get(client_id)
+        if lane is None:
+            lane = self.lanes[client_id] = _Lane()
+
+        if supersedable:
+            while lane.waiting:
+                self._cancel_waiting(lane, lane.waiting[0])
+                self.cancelled += 1
+            if self.max_waiting and len(self._waiting) >= self.max_waiting:
+                oldest, oldest_lane = next(iter(self._waiting.items()))
+                self._cancel_waiting(oldest_lane, oldest)
+                self.shed += 1
+
+        seq = lane.next_seq
+        lane.next_seq += 1
+        self.submitted += 1
+
+        task = asyncio.create_task(self._run(lane, seq, lane.epoch, request, deliver, supersedable))
+        lane.tasks.add(task)
+        task.add_done_callback(lane.tasks.discard)
+        if supersedable:
+            lane.waiting.append(task)
+            self._waiting[task] = lane
+        return task
+
+    async def _run(self, lane, seq, epoch, request, deliver, supersedable):
+        async with self._semaphore:
+            if supersedable:
+                task = asyncio.current_task()
+                lane.waiting.remove(task)
+                del self._waiting[task]
+            self.in_flight += 1
+            try:
+                result = await request()
+            except Exception as e:
+                self.failed += 1
+                logger.error(f"Error in ASR service communication: {e}")
+                return
+            finally:
+                self.in_flight -= 1
+
+        async with lane.lock:
+            if epoch != lane.epoch or (supersedable and seq < lane.delivered_seq):
+                self.dropped += 1
+                return
+            lane.delivered_seq = max(lane.delivered_seq, seq)
+            self.delivered += 1
+            try:
+                await deliver(result)
+            except Exception as e:
+                logger.error(f"Error delivering transcription: {e}")
+
+    def supersede(self, client_id):
+        """Drop everything pending for a client, e.g. when its utterance ends."""
+        lane = self.lanes.get(client_id)
+        if lane is None:
+            return
+        lane.epoch += 1
+        while lane.waiting:
+            self._cancel_waiting(lane, lane.waiting[0])
+            self.cancelled += 1
+
+    def remove(self, client_id):
+        lane = self.lanes.pop(client_id, None)
+        if lane is None:
+            return
+        for task in lane.waiting:
+            del self._waiting[task]
+        for task in lane.tasks:
+            task.cancel()
+
+    def stats(self):
+        return {
+            "max_concurrency": self.max_concurrency,
+            "clients": len(self.lanes),
+            "in_flight": self.in_flight,
+            "max_waiting": self.max_waiting or 0,
+            "queued": len(self._waiting),
+            "submitted": self.submitted,
+            "delivered": self.delivered,
+            "cancelled": self.cancelled,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "shed": self.shed,
+        }
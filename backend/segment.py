@@ -0,0 +1,163 @@
+import os
+import re
+
+# How an LLM answer is cut into pieces for TTS: 'sentence' splits at every
+# sentence mark, 'latency' cuts the first clause early and merges short
+# fragments (see LatencySegmenter).
+TTS_SEGMENTATION = os.getenv('TTS_SEGMENTATION', 'latency')
+TTS_FIRST_CLAUSE_CHARS = int(os.getenv('TTS_FIRST_CLAUSE_CHARS', '8'))
+TTS_FIRST_SEGMENT_MAX_CHARS = int(os.getenv('TTS_FIRST_SEGMENT_MAX_CHARS', '80'))
+TTS_MIN_SEGMENT_CHARS = int(os.getenv('TTS_MIN_SEGMENT_CHARS', '40'))
+
+# Words that end in a period without ending the sentence, lower-cased and
+# without the period.
+ABBREVIATIONS = frozenset((
+    'tp', 'q', 'p', 'tx', 'ts', 'ths', 'pgs', 'gs', 'bs', 'ks', 'đc', 'sđt', 'stt',
+    'mr', 'mrs', 'ms', 'dr', 'st', 'no', 'vs', 'e.g', 'i.e', 'etc',
+))
+
+
+class Segmenter:
+    """Cuts one streamed answer into the pieces that are synthesized.
+
+    ``feed`` takes the next piece of text and returns the segments it
+    completes; ``flush`` returns what is left once the answer has ended.
+    A segmenter holds the state of a single answer.
+    """
+
+    def feed(self, text):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+
+class SentenceSegmenter(Segmenter):
+    """Splits at every ``.``, ``!``, ``?`` and ``:``."""
+
+    pattern = re.compile(r'[.!?:]\s*')
+
+    def __init__(self):
+        self.buffer = ""
+
+    def feed(self, text):
+        self.buffer += text
+        segments = []
+        while True:
+            match = self.pattern.search(self.buffer)
+            if not match:
+                return segments
+            segments.append(self.buffer[:match.end()].strip())
+            self.buffer = self.buffer[match.end():]
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+
+class LatencySegmenter(Segmenter):
+    """Segments for a short time to first audio and few TTS requests.
+
+    The first segment ends at the first clause boundary (a comma counts)
+    once it has ``first_clause_chars`` characters. If there is no boundary
+    within ``first_max_chars``, it is cut at the last word boundary before
+    that. Later segments end at sentence boundaries, with short sentences
+    merged into the next until there are ``min_chars``; lookahead synthesis
+    hides their latency anyway, and every segment costs a TTS round trip.
+
+    A mark only counts once the whitespace after it has arrived, so
+    "3.5" and "8:30" are never split, and the segments are the same
+    however the LLM stream is chunked. List numbers ("1. ", a number
+    starting a line) and periods after common abbreviations or before a
+    lowercase word are not boundaries either.
+    """
+
+    boundary = re.compile(r'[.!?:;,…]+(?=\s)|\n')
+    sentence_marks = frozenset('.!?:…\n')
+
+    def __init__(self, first_clause_chars=TTS_FIRST_CLAUSE_CHARS,
+                 first_max_chars=TTS_FIRST_SEGMENT_MAX_CHARS, min_chars=TTS_MIN_SEGMENT_CHARS):
+        self.first_clause_chars = first_clause_chars
+        self.first_max_chars = first_max_chars
+        self.min_chars = min_chars
+        self.buffer = ""
+        self.segments = 0
+
+    def _is_boundary(self, match):
+        """True or False, or None if the text after the match hasn't arrived yet."""
+        if match.group() != '.':
+            return True
+        text = self.buffer
+        before = text[:match.start()]
+        words = before.split()
+        word = words[-1] if words else ''
+        if word.lower() in ABBREVIATIONS:
+            return False
+        if not word.isdigit():
+            return True
+
+        # "1." alone at the start of the segment or a line is a list marker.
+        line = before[before.rfind('\n') + 1:]
+        if line.strip() == word:
+            return False
+        # "8. sáng" continues the sentence, "8. Đóng" starts a new one.
+        rest = text[match.end():].lstrip()
+        if not rest:
+            return None
+        return not rest[0].islower()
+
+    def _cut(self):
+        """Index where the next segment ends, or None to wait for more text."""
+        first = self.segments == 0
+        for match in self.boundary.finditer(self.buffer):
+            if first and match.end() > self.first_max_chars:
+                break
+            is_boundary = self._is_boundary(match)
+            if is_boundary is None:
+                return None
+            if not is_boundary:
+                continue
+            length = len(self.buffer[:match.end()].strip())
+            if first:
+                if length >= self.first_clause_chars:
+                    return match.end()
+            elif length >= self.min_chars and match.group()[-1] in self.sentence_marks:
+                return match.end()
+
+        # Only once text past first_max_chars has arrived is it certain that
+        # no boundary ends within it.
+        if first and len(self.buffer) > self.first_max_chars:
+            space = self.buffer.rfind(' ', self.first_clause_chars, self.first_max_chars + 1)
+            if space > 0:
+                return space
+        return None
+
+    def feed(self, text):
+        self.buffer += text
+        segments = []
+        while True:
+            end = self._cut()
+            if end is None:
+                return segments
+            segment = self.buffer[:end].strip()
+            self.buffer = self.buffer[end:]
+            if segment:
+                segments.append(segment)
+                self.segments += 1
+
+    def flush(self):
+        rest, self.buffer = self.buffer.strip(), ""
+        return [rest] if rest else []
+
+
+SEGMENTERS = {
+    'sentence': SentenceSegmenter,
+    'latency': LatencySegmenter,
+}
+
+
+def create_segmenter(name=None):
+    name = name or TTS_SEGMENTATION
+    if name not in SEGMENTERS:
+        raise ValueError(f"Unknown segmentation policy: {name}")
+    return SEGMENTERS[name]()
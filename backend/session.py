@@ -0,0 +1,153 @@
+import asyncio
+import sys
+import time
+
+from backend.vad import FrameSplitter
+
+
+class AudioRing:
+    """Preallocated, fixed-capacity store for the audio of one utterance.
+
+    Offsets are absolute byte positions since the last ``clear()``; once more
+    than ``capacity`` bytes were written the oldest audio is overwritten and
+    reads are clamped to what is still retained.
+    """
+
+    __slots__ = ('capacity', 'total', 'overwritten', '_buf', '_view')
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.total = 0
+        self.overwritten = 0
+        self._buf = bytearray(capacity)
+        self._view = memoryview(self._buf)
+
+    def __len__(self):
+        return self.total
+
+    def clear(self):
+        self.total = 0
+
+    def extend(self, data):
+        data = memoryview(data)
+        if len(data) > self.capacity:
+            data = data[len(data) - self.capacity:]
+        pos = self.total % self.capacity
+        first = min(len(data), self.capacity - pos)
+        self._view[pos:pos + first] = data[:first]
+        self._view[:len(data) - first] = data[first:]
+        self.total += len(data)
+        self.overwritten = max(0, self.total - self.capacity)
+
+    def span(self, start, stop):
+        """Clamp ``[start, stop)`` to the audio still held in the ring."""
+        start = max(start, self.overwritten)
+        stop = min(stop, self.total)
+        return start, max(start, stop)
+
+    def read(self, start, stop, prefix=b''):
+        """Copy ``[start, stop)`` into a new buffer that begins with ``prefix``."""
+        start, stop = self.span(start, stop)
+        length = stop - start
+        out = bytearray(len(prefix) + length)
+        out[:len(prefix)] = prefix
+        pos = start % self.capacity
+        first = min(length, self.capacity - pos)
+        out[len(prefix):len(prefix) + first] = self._view[pos:pos + first]
+        out[len(prefix) + first:] = self._view[:length - first]
+        return out
+
+
+class ASRSession:
+    """Everything the ASR gateway keeps for one connected client."""
+
+    __slots__ = (
+        'client_id', 'session_id', 'websocket', 'codec', 'decoder', 'splitter', 'audio',
+        'transcript', 'transcript_updated', 'endpointer', 'speech_detected', 'speech_start_time', 'last_speech_time',
+        'last_process_offset', 'connected_at',
+        'bytes_received', 'bytes_decoded', 'frames', 'speech_frames', 'partials_sent',
+        'finals_sent', 'utterances', 'audio_lost'
+    )
+
+    def __init__(self, client_id, session_id, websocket, frame_bytes, audio_capacity, transcript, endpointer,
+                 codec='pcm', decoder=None):
+        self.client_id = client_id
+        self.session_id = session_id
+        self.websocket = websocket
+        # What the client sends; decoder is None for raw PCM.
+        self.codec = codec
+        self.decoder = decoder
+        self.splitter = FrameSplitter(frame_bytes)
+        self.audio = AudioRing(audio_capacity)
+        self.transcript = transcript
+        # Set whenever an upstream result is applied to the transcript.
+        self.transcript_updated = asyncio.Event()
+        self.endpointer = endpointer
+
+        self.speech_detected = False
+        self.speech_start_time = None
+        self.last_speech_time = None
+        # Audio offset of the last upstream request in this utterance.
+        self.last_process_offset = 0
+        self.connected_at = time.time()
+
+        self.bytes_received = 0
+        self.bytes_decoded = 0
+        self.frames = 0
+        self.speech_frames = 0
+        self.partials_sent = 0
+        self.finals_sent = 0
+        self.utterances = 0
+        # Bytes overwritten in the ring before they were sent upstream.
+        self.audio_lost = 0
+
+    def start_utterance(self, current_time, transcript):
+        self.speech_detected = True
+        self.audio.clear()
+        self.transcript = transcript
+        self.speech_start_time = current_time
+        self.last_process_offset = 0
+        self.utterances += 1
+
+    @property
+    def utterance_id(self):
+        """Ties together the spans of one utterance, across the gateway and the app."""
+        return f"{self.session_id}-{self.utterances}"
+
+    def end_utterance(self):
+        self.speech_detected = False
+        self.audio.clear()
+        self.speech_start_time = None
+        self.last_speech_time = None
+
+    def memory_report(self):
+        """Approximate bytes held by this session, by component."""
+        audio = sys.getsizeof(self.audio) + sys.getsizeof(self.audio._buf)
+        splitter = sys.getsizeof(self.splitter) + sys.getsizeof(self.splitter._carry)
+        transcript = sys.getsizeof(self.transcript) + sum(
+            sys.getsizeof(segment) for segment in self.transcript.segments
+        ) + sys.getsizeof(self.transcript.partial) + sys.getsizeof(self.transcript.pauses)
+        session = sys.getsizeof(self)
+        return {
+            "session": session,
+            "audio": audio,
+            "splitter": splitter,
+            "transcript": transcript,
+            "total": session + audio + splitter + transcript,
+        }
+
+    def stats(self):
+        return {
+            "connected_for": time.time() - self.connected_at,
+            "codec": self.codec,
+            "bytes_received": self.bytes_received,
+            "bytes_decoded": self.bytes_decoded,
+            "frames": self.frames,
+            "speech_frames": self.speech_frames,
+            "partials_sent": self.partials_sent,
+            "finals_sent": self.finals_sent,
+            "utterances": self.utterances,
+            "audio_overwritten": self.audio.overwritten,
+            "audio_lost": self.audio_lost,
+            "endpointer": self.endpointer.stats(),
+        }
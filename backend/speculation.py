@@ -0,0 +1,177 @@
+import asyncio
+import logging
+import os
+from contextlib import aclosing
+
+from backend.answer_cache import normalize_query
+from backend.metrics import REGISTRY
+from backend.tts import TTS_VOICE, gemini_text_generator, preprocess_text, synthesize_sentence
+
+logger = logging.getLogger('speculation')
+
+# 'off', 'llm' to start the answer early, or 'tts' to also synthesize its
+# first sentence.
+SPECULATION = os.getenv('SPECULATION', 'off')
+SPECULATION_STABLE_SECONDS = float(os.getenv('SPECULATION_STABLE_SECONDS', '0.1'))
+
+
+def speculation_key(text):
+    return normalize_query(preprocess_text(text))
+
+
+class SpeculationCounters:
+    """Process-wide outcome of speculative responses."""
+
+    __slots__ = ('started', 'hits', 'discarded', 'finals_without', 'wasted_chars', 'wasted_syntheses')
+
+    def __init__(self):
+        self.started = 0
+        self.hits = 0
+        self.discarded = 0
+        self.finals_without = 0
+        self.wasted_chars = 0
+        self.wasted_syntheses = 0
+
+    def stats(self):
+        return {
+            "started": self.started,
+            "hits": self.hits,
+            "discarded": self.discarded,
+            "hit_rate": self.hits / self.started if self.started else 0.0,
+            "finals_without": self.finals_without,
+            "wasted_chars": self.wasted_chars,
+            "wasted_syntheses": self.wasted_syntheses,
+        }
+
+
+counters = SpeculationCounters()
+REGISTRY.stats_gauges('llm_speculation', 'Speculative answers started on stable partials.', counters.stats)
+
+
+class Speculation:
+    """An answer generated in the background from a partial transcript.
+
+    Sentences are buffered as they arrive; ``sentences()`` replays them and
+    then follows the live stream. With ``prefetch_audio`` the first sentence
+    is synthesized as soon as it is known, and handed over via ``audio``.
+    """
+
+    def __init__(self, query, prefetch_audio=False, voice=TTS_VOICE):
+        self.query = query
+        self.key = speculation_key(query)
+        self.prefetch_audio = prefetch_audio
+        self.voice = voice
+        self.generated = []
+        self.audio = {}
+        self.done = False
+        self.error = None
+        self._updated = asyncio.Event()
+        self.task = asyncio.create_task(self._generate())
+
+    def _notify(self):
+        self._updated.set()
+        self._updated = asyncio.Event()
+
+    async def _generate(self):
+        try:
+            async with aclosing(gemini_text_generator(self.query)) as gen_text:
+                async for sentence in gen_text:
+                    if self.prefetch_audio and not self.generated and sentence.strip():
+                        self.audio[sentence] = asyncio.create_task(synthesize_sentence(sentence, self.voice))
+                    self.generated.append(sentence)
+                    self._notify()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            self._notify()
+
+    async def sentences(self):
+        index = 0
+        while True:
+            if index < len(self.generated):
+                yield self.generated[index]
+                index += 1
+            elif self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+            else:
+                await self._updated.wait()
+
+    def cancel(self):
+        """Stop generating; returns how many prefetched syntheses were thrown away."""
+        self.task.cancel()
+        wasted = len(self.audio)
+        for task in self.audio.values():
+            task.cancel()
+        self.audio.clear()
+        return wasted
+
+
+class Speculator:
+    """Starts a Speculation once the partial transcript stops changing.
+
+    A partial received while the caller is silent starts one if the text
+    stays the same for ``stable_seconds``; a partial that differs discards
+    it. Partials during speech only reset the clock, since more words are
+    on the way. The final transcript either takes the speculation over,
+    when it matches, or discards it.
+    """
+
+    def __init__(self, mode=SPECULATION, stable_seconds=SPECULATION_STABLE_SECONDS):
+        if mode not in ('llm', 'tts'):
+            raise ValueError(f"Unknown speculation mode: {mode}")
+        self.prefetch_audio = mode == 'tts'
+        self.stable_seconds = stable_seconds
+        self.key = None
+        self.timer = None
+        self.current = None
+
+    def _discard(self):
+        speculation, self.current = self.current, None
+        if speculation is None:
+            return
+        counters.discarded += 1
+        counters.wasted_chars += sum(len(sentence) for sentence in speculation.generated)
+        counters.wasted_syntheses += speculation.cancel()
+        logger.info(f"Discarded speculative answer for: {speculation.query}")
+
+    def _reset(self):
+        if self.timer is not None:
+            self.timer.cancel()
+            self.timer = None
+        self.key = None
+
+    def _start(self, text):
+        self.timer = None
+        counters.started += 1
+        self.current = Speculation(text, prefetch_audio=self.prefetch_audio)
+        logger.info(f"Speculating on stable partial: {text}")
+
+    def on_partial(self, text, trailing_silence=0.0):
+        key = speculation_key(text)
+        if key == self.key and (self.timer is not None or self.current is not None):
+            return
+        self._reset()
+        self._discard()
+        self.key = key
+        if key and trailing_silence > 0:
+            self.timer = asyncio.get_running_loop().call_later(self.stable_seconds, self._start, text)
+
+    def take(self, final_text):
+        """The speculation for ``final_text``, if there is one; any other is discarded."""
+        self._reset()
+        speculation = self.current
+        if speculation is not None and speculation.key == speculation_key(final_text):
+            self.current = None
+            counters.hits += 1
+            return speculation
+        if speculation is None:
+            counters.finals_without += 1
+        self._discard()
+        return None
+
+    def close(self):
+        self._reset()
+        self._discard()
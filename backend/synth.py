@@ -0,0 +1,59 @@
+import os
+import logging
+
+import edge_tts
+
+logger = logging.getLogger('synth')
+
+TTS_BACKEND = os.getenv('TTS_BACKEND', 'edge')
+
+
+class TTSBackend:
+    """Something that streams audio for one sentence.
+
+    ``stream`` is an async generator of audio byte chunks, in the format
+    given by ``mime_type``; clients are told it when they connect.
+    """
+
+    mime_type = 'audio/mpeg'
+
+    async def stream(self, text: str, voice: str):
+        raise NotImplementedError
+        yield
+
+
+class EdgeTTSBackend(TTSBackend):
+    # edge-tts 7.0 always requests audio-24khz-48kbitrate-mono-mp3.
+    mime_type = 'audio/mpeg'
+
+    async def stream(self, text: str, voice: str):
+        communicate = edge_tts.Communicate(text, voice)
+        async for tts_chunk in communicate.stream():
+            if tts_chunk["type"] == "audio":
+                yield tts_chunk["data"]
+
+
+_backend = None
+
+
+def create_tts_backend(name: str):
+    if name == 'edge':
+        return EdgeTTSBackend()
+    if name == 'fake':
+        from backend.fake_tts import FakeTTSBackend
+        return FakeTTSBackend()
+    raise ValueError(f"Unknown TTS backend: {name}")
+
+
+def get_tts_backend():
+    global _backend
+    if _backend is None:
+        _backend = create_tts_backend(TTS_BACKEND)
+        logger.info(f"Using TTS backend: {type(_backend).__name__}")
+    return _backend
+
+
+def set_tts_backend(backend):
+    """Replace the process-wide backend, e.g. with a fake in tests and benchmarks."""
+    global _backend
+    _backend = backend
@@ -0,0 +1,45 @@
+import unittest
+
+from backend.segment import LatencySegmenter
+
+ANSWERS = [
+    "Cửa hàng được thành lập năm 2020. Chúng tôi phục vụ từ thứ hai đến chủ nhật hàng tuần. Hãy gọi nhé.",
+    "Mở cửa lúc 8. Đóng cửa lúc 22 giờ hàng ngày nhé bạn.",
+    "Giá là 3.5 triệu, mở lúc 8:30 sáng. Các bước:\n1. Gọi điện.\n2. Đặt lịch hẹn trước nhé. Xong.",
+    "Chúng tôi có rất nhiều sản phẩm chăm sóc da dành cho mọi loại da và mọi độ tuổi khác nhau mà bạn có thể chọn",
+]
+
+
+def segment(text, chunk_size):
+    segmenter = LatencySegmenter()
+    segments = []
+    for start in range(0, len(text), chunk_size):
+        segments.extend(segmenter.feed(text[start:start + chunk_size]))
+    return segments + segmenter.flush()
+
+
+class LatencySegmenterTest(unittest.TestCase):
+    def test_same_segments_for_any_chunking(self):
+        for text in ANSWERS:
+            expected = segment(text, len(text))
+            for chunk_size in (1, 2, 3, 7, 24):
+                self.assertEqual(segment(text, chunk_size), expected, f"chunk size {chunk_size}: {text}")
+
+    def test_sentence_ending_in_number_is_a_boundary(self):
+        self.assertEqual(segment(ANSWERS[1], 1), ["Mở cửa lúc 8.", "Đóng cửa lúc 22 giờ hàng ngày nhé bạn."])
+        self.assertEqual(segment(ANSWERS[0], 1)[0], "Cửa hàng được thành lập năm 2020.")
+
+    def test_numbers_and_list_markers_are_not_split(self):
+        segments = segment(ANSWERS[2], 1)
+        self.assertEqual(segments[0], "Giá là 3.5 triệu,")
+        self.assertIn("8:30", segments[1])
+        self.assertTrue(all(not s.endswith(("1.", "2.")) for s in segments))
+
+    def test_long_first_segment_is_cut_at_a_word(self):
+        first = segment(ANSWERS[3], 1)[0]
+        self.assertLessEqual(len(first), LatencySegmenter().first_max_chars)
+        self.assertTrue(ANSWERS[3].startswith(first + " "))
+
+
+if __name__ == "__main__":
+    unittest.main()
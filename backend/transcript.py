@@ -0,0 +1,67 @@
+class SlidingWindowTranscript:
+    """Tracks which part of an utterance still has to go upstream.
+
+    With ``window_bytes=None`` every request covers the whole utterance.
+    Otherwise only the audio after the last committed cut is sent. Once that window grows past ``window_bytes`` the
+    next request is a commit: it covers the window up to the latest pause
+    (or all of it if there was none), its text becomes a fixed prefix of the
+    transcript and the window restarts at the cut.
+    """
+
+    __slots__ = ('window_bytes', 'window_start', 'window_id', 'pauses', 'segments', 'partial')
+
+    def __init__(self, window_bytes=None):
+        self.window_bytes = window_bytes
+        self.window_start = 0
+        self.window_id = 0
+        self.pauses = []
+        self.segments = []
+        self.partial = ''
+
+    def mark_pause(self, offset):
+        if self.window_bytes is not None:
+            self.pauses.append(offset)
+
+    def next_request(self, end):
+        """Return ``(start, stop, ticket)`` for the audio to send next."""
+        if self.window_bytes is None or end - self.window_start <= self.window_bytes:
+            return self.window_start, end, (self.window_id, None)
+
+        earliest_cut = self.window_start + self.window_bytes // 2
+        cut = end
+        for offset in reversed(self.pauses):
+            if offset <= earliest_cut:
+                break
+            if offset <= end:
+                cut = offset
+                break
+
+        start = self.window_start
+        slot = len(self.segments)
+        self.segments.append(None)
+        self.window_start = cut
+        self.window_id += 1
+        self.pauses = [offset for offset in self.pauses if offset > cut]
+        self.partial = ''
+        return start, cut, (self.window_id - 1, slot)
+
+    def apply(self, ticket, text):
+        """Record an upstream result and return the stitched transcript."""
+        window_id, slot = ticket
+        if slot is not None:
+            self.segments[slot] = text
+        elif window_id == self.window_id:
+            self.partial = text
+        return self.text
+
+    @property
+    def pending_commit(self):
+        """Whether a commit was requested whose text hasn't arrived yet."""
+        return None in self.segments
+
+    @property
+    def text(self):
+        parts = [segment for segment in self.segments if segment]
+        if self.partial:
+            parts.append(self.partial)
+        return " ".join(parts)
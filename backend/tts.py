@@ -1,14 +1,19 @@
 import asyncio
 import os
-import json
-from google import genai
-from pydub import AudioSegment
-import edge_tts
 import re
 import time
-from io import BytesIO
 from dotenv import load_dotenv
 import logging
+from contextlib import aclosing
+
+from backend.admission import Limiter
+from backend.answer_cache import AnswerCache
+from backend.audio_cache import AudioCache
+from backend.llm import get_llm_backend
+from backend.metrics import REGISTRY, observe
+from backend.mp3 import mp3_duration
+from backend.segment import create_segmenter
+from backend.synth import get_tts_backend
 
 logging.basicConfig(
     level=logging.INFO,
@@ -19,76 +24,255 @@ logger = logging.getLogger('tts_server')
 
 load_dotenv()
 
+TTS_VOICE = "vi-VN-HoaiMyNeural"
+TTS_LOOKAHEAD = int(os.getenv('TTS_LOOKAHEAD', '3'))
+
+# Process-wide caps on concurrent Gemini and edge-tts requests; 0 disables one.
+# Requests beyond the cap wait up to *_MAX_WAIT seconds, if fewer than
+# *_MAX_WAITING are already waiting, and are shed otherwise.
+llm_limiter = Limiter(
+    'llm',
+    int(os.getenv('LLM_MAX_CONCURRENCY', '32')),
+    max_waiting=int(os.getenv('LLM_MAX_WAITING', '64')),
+    max_wait=float(os.getenv('LLM_MAX_WAIT', '3.0'))
+)
+tts_limiter = Limiter(
+    'tts',
+    int(os.getenv('TTS_MAX_CONCURRENCY', '48')),
+    max_waiting=int(os.getenv('TTS_MAX_WAITING', '96')),
+    max_wait=float(os.getenv('TTS_MAX_WAIT', '3.0'))
+)
+
+audio_cache = AudioCache(
+    max_bytes=int(os.getenv('TTS_CACHE_BYTES', str(32 * 1024 * 1024))),
+    disk_dir=os.getenv('TTS_CACHE_DIR') or None,
+    max_disk_bytes=int(os.getenv('TTS_CACHE_DISK_BYTES', str(512 * 1024 * 1024)))
+)
+
+answer_cache = AnswerCache(
+    max_entries=int(os.getenv('LLM_ANSWER_CACHE_SIZE', '1024')),
+    ttl=float(os.getenv('LLM_ANSWER_CACHE_TTL', '3600'))
+)
+
+REGISTRY.stats_gauges('tts_audio_cache', 'Synthesized sentence audio cache.', audio_cache.stats)
+REGISTRY.stats_gauges('llm_answer_cache', 'Segmented LLM answer cache.', answer_cache.stats)
+REGISTRY.stats_gauges('llm_limiter', 'Concurrent LLM requests and shed load.', llm_limiter.stats)
+REGISTRY.stats_gauges('tts_limiter', 'Concurrent TTS requests and shed load.', tts_limiter.stats)
+
 def preprocess_text(text):    
     text = re.sub(r'\bunk\b', '', text)
     return text
 
-def gemini_text_generator(query: str):
+async def gemini_text_generator(query: str, backend=None, segmenter=None):
     logging.info(f"Received query: {query}")
-    client = genai.Client(api_key=os.getenv('GOOGLE_API_KEY'), vertexai=False)
-    chat = client.chats.create(model="gemini-2.0-flash-001")
-    
-    pattern = re.compile(r'[.!?:]\s*')
+    backend = backend or get_llm_backend()
+    segmenter = segmenter or create_segmenter()
     
     preprocess_query = preprocess_text(query)
 
+    cached = answer_cache.get(preprocess_query)
+    if cached is not None:
+        logging.info(f"Answer cache hit for query: {preprocess_query}")
+        for sentence in cached:
+            yield sentence
+        return
+
     prompt = f"bạn trả lời chính xác ngắn gọn thôi nhé: {preprocess_query}"
     
-    buffer = ""
+    sentences = []
+    request_start = time.perf_counter()
     
-    for chunk in chat.send_message_stream(prompt):
-        clean_text = chunk.text.replace("*", "")
-        buffer += clean_text
-        
-        while True:
-            match = pattern.search(buffer)
-            
-            if match:
-                sentence = buffer[:match.end()].strip()
+    async with llm_limiter.slot(), aclosing(backend.stream(prompt)) as chunks:
+        async for text in chunks:
+            if request_start is not None:
+                observe('llm_first_token', time.perf_counter() - request_start)
+                request_start = None
+            clean_text = text.replace("*", "")
+            for sentence in segmenter.feed(clean_text):
+                sentences.append(sentence)
                 yield sentence
-                buffer = buffer[match.end():]
-            else:
-                break
     
-    if buffer.strip():
-        yield buffer.strip()
+    for sentence in segmenter.flush():
+        sentences.append(sentence)
+        yield sentence
 
-async def text_to_speech_stream(query: str):
-    voice = "vi-VN-HoaiMyNeural"
-    
-    gen_text = gemini_text_generator(query)
-    
-    for chunk in gen_text:
-        
-        if not chunk or not chunk.strip():
-            continue
-        
-        start_time_chunk = time.time()
-        communicate = edge_tts.Communicate(chunk, voice)
+    # Only reached when the answer streamed to the end, so a cancelled or
+    # failed request is never cached.
+    answer_cache.put(preprocess_query, sentences)
+
+async def synthesize_sentence(text: str, voice: str, on_chunk=None):
+    """Audio for one sentence. ``on_chunk`` sees each chunk as the backend
+    produces it; it is not called for cached audio."""
+    cached = await audio_cache.get(voice, text)
+    if cached is not None:
+        return cached
+
+    async with tts_limiter.slot():
+        synthesis_start = time.perf_counter()
         audio_data = bytearray()
-        async for tts_chunk in communicate.stream():
-            if tts_chunk["type"] == "audio":
-                audio_data.extend(tts_chunk["data"])
-    
-        
-        audio_segment = AudioSegment.from_mp3(BytesIO(audio_data))
-        duration_seconds = len(audio_segment) / 1000.0
- 
-        processing_time = time.time() - start_time_chunk
-        
-        sleep_time = max(0, duration_seconds - processing_time)
-        
-        data = {
-            "text": chunk,
-            "audio": audio_data.hex(),
-            "duration": sleep_time
-        }
-        yield f"event: ttsUpdate\ndata: {json.dumps(data)}\n\n"
-
-        logging.info('Finish Chunk ---------------------')
-        
-        await asyncio.sleep(sleep_time)
- 
+        async for audio_chunk in get_tts_backend().stream(text, voice):
+            if not audio_data:
+                observe('tts_first_byte', time.perf_counter() - synthesis_start)
+            audio_data.extend(audio_chunk)
+            if on_chunk is not None:
+                on_chunk(audio_chunk)
+        observe('tts_synthesis', time.perf_counter() - synthesis_start)
+
+    audio_cache.put(voice, text, audio_data)
+    return audio_data
+
+class TTSUpdate:
+    """Audio for one sentence, ready to be sent to the browser.
+
+    Streamed sentences arrive as several updates numbered by ``part``; the
+    ``final`` one has no audio and carries the duration.
+    """
+
+    __slots__ = ('seq', 'text', 'audio', 'duration', 'part', 'final')
+
+    def __init__(self, seq: int, text: str, audio: bytes, duration: float, part: int = 0, final: bool = True):
+        self.seq = seq
+        self.text = text
+        self.audio = audio
+        self.duration = duration
+        self.part = part
+        self.final = final
+
+def make_tts_update(seq: int, text: str, audio_data: bytearray, start_time_chunk: float):
+    duration_seconds = mp3_duration(audio_data)
 
+    processing_time = time.time() - start_time_chunk
 
+    sleep_time = max(0, duration_seconds - processing_time)
+
+    return TTSUpdate(seq, text, audio_data, sleep_time)
+
+async def stream_sentence(seq: int, text: str, task, chunks: asyncio.Queue, start_time_chunk: float):
+    """Updates for one sentence as its audio arrives from ``chunks``.
+
+    ``task`` is the synthesis feeding the queue; once it finishes, a final
+    update closes the sentence. Cached and prefetched audio never goes
+    through the queue and is sent in one piece.
+    """
+    task.add_done_callback(lambda _: chunks.put_nowait(None))
+    part = 0
+    try:
+        while True:
+            audio_chunk = await chunks.get()
+            if audio_chunk is None:
+                break
+            yield TTSUpdate(seq, text, audio_chunk, 0.0, part=part, final=False)
+            part += 1
+
+        audio_data = await task
+        if part == 0:
+            yield TTSUpdate(seq, text, audio_data, 0.0, part=part, final=False)
+            part += 1
+        update = make_tts_update(seq, text, audio_data, start_time_chunk)
+        yield TTSUpdate(seq, text, b'', update.duration, part=part)
+    finally:
+        task.cancel()
+
+async def text_to_speech_stream(query: str, lookahead: int = TTS_LOOKAHEAD, sentences=None, prefetched=None,
+                                stream_chunks=False):
+    """Stream one TTSUpdate per generated sentence.
+
+    With ``lookahead`` > 0 up to that many upcoming sentences are synthesized
+    concurrently while earlier ones are being played, and each event is
+    yielded, in order, as soon as its audio is ready. With ``lookahead=0``
+    sentences are synthesized one at a time and the stream sleeps for each
+    sentence's playback time before starting the next.
+
+    With ``stream_chunks`` a sentence's audio is yielded chunk by chunk as
+    the TTS backend produces it (see ``stream_sentence``), so playback can
+    start after the first byte rather than the whole sentence.
+
+    ``sentences`` replaces the LLM answer for ``query``, and ``prefetched``
+    maps sentences to synthesis tasks that were already started; both come
+    from a speculative answer.
+    """
+    voice = TTS_VOICE
+    seq = 0
+
+    if sentences is None:
+        sentences = gemini_text_generator(query)
+
+    def synthesize(text, on_chunk=None):
+        task = prefetched.pop(text, None) if prefetched else None
+        return task if task is not None else synthesize_sentence(text, voice, on_chunk)
+
+    def start_streaming(text):
+        chunks = asyncio.Queue()
+        return asyncio.ensure_future(synthesize(text, chunks.put_nowait)), chunks
+
+    if lookahead <= 0:
+        async with aclosing(sentences) as gen_text:
+            async for chunk in gen_text:
+                if not chunk or not chunk.strip():
+                    continue
+
+                start_time_chunk = time.time()
+                if stream_chunks:
+                    task, chunks = start_streaming(chunk)
+                    async with aclosing(stream_sentence(seq, chunk, task, chunks, start_time_chunk)) as parts:
+                        async for update in parts:
+                            yield update
+                else:
+                    audio_data = await synthesize(chunk)
+                    update = make_tts_update(seq, chunk, audio_data, start_time_chunk)
+                    yield update
+                seq += 1
+
+                logging.info('Finish Chunk ---------------------')
+
+                await asyncio.sleep(update.duration)
+        return
+
+    slots = asyncio.Semaphore(lookahead)
+    pending = asyncio.Queue()
+
+    async def produce():
+        try:
+            async with aclosing(sentences) as gen_text:
+                async for chunk in gen_text:
+                    if not chunk.strip():
+                        continue
+
+                    await slots.acquire()
+                    if stream_chunks:
+                        task, chunks = start_streaming(chunk)
+                    else:
+                        task, chunks = asyncio.ensure_future(synthesize(chunk)), None
+                    await pending.put((chunk, time.time(), task, chunks))
+        except Exception as e:
+            await pending.put(e)
+        finally:
+            await pending.put(None)
+
+    producer = asyncio.create_task(produce())
+    try:
+        while True:
+            item = await pending.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+
+            chunk, start_time_chunk, task, chunks = item
+            if chunks is not None:
+                async with aclosing(stream_sentence(seq, chunk, task, chunks, start_time_chunk)) as parts:
+                    async for update in parts:
+                        yield update
+            else:
+                audio_data = await task
+                yield make_tts_update(seq, chunk, audio_data, start_time_chunk)
+            seq += 1
+            slots.release()
 
+            logging.info('Finish Chunk ---------------------')
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if isinstance(item, tuple):
+                item[2].cancel()
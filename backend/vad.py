@@ -0,0 +1,69 @@
+import numpy as np
+
+
+class FrameSplitter:
+    """Cuts arbitrarily sized PCM messages into exact VAD frames.
+
+    Whole frames inside a message are handed out as memoryview slices of
+    the message itself; only the bytes that straddle two messages are
+    copied, into a carry buffer of exactly one frame.
+    """
+
+    def __init__(self, frame_bytes):
+        self.frame_bytes = frame_bytes
+        self._carry = bytearray(frame_bytes)
+        self._carry_len = 0
+
+    def feed(self, message):
+        """Yield blocks of whole frames, each a memoryview whose length is a
+        multiple of ``frame_bytes``.
+
+        Blocks are only valid until the generator is resumed.
+        """
+        view = memoryview(message)
+        offset = 0
+
+        if self._carry_len:
+            offset = min(self.frame_bytes - self._carry_len, len(view))
+            self._carry[self._carry_len:self._carry_len + offset] = view[:offset]
+            self._carry_len += offset
+            if self._carry_len < self.frame_bytes:
+                return
+            self._carry_len = 0
+            yield memoryview(self._carry)
+
+        whole = (len(view) - offset) // self.frame_bytes * self.frame_bytes
+        if whole:
+            yield view[offset:offset + whole]
+            offset += whole
+
+        rest = len(view) - offset
+        if rest:
+            self._carry[:rest] = view[offset:]
+            self._carry_len = rest
+
+
+class EnergyGate:
+    """Cheap RMS pre-check that keeps clearly silent frames away from webrtcvad."""
+
+    def __init__(self, frame_size, threshold=100.0):
+        self.frame_size = frame_size
+        self.threshold = threshold
+        self.frames = 0
+        self.gated = 0
+
+    def loud_frames(self, block):
+        """Return a boolean array with one entry per frame in ``block``."""
+        samples = np.frombuffer(block, dtype=np.int16).reshape(-1, self.frame_size).astype(np.float32)
+        mean_square = np.einsum('ij,ij->i', samples, samples) / self.frame_size
+        loud = mean_square >= self.threshold * self.threshold
+        self.frames += len(loud)
+        self.gated += len(loud) - int(np.count_nonzero(loud))
+        return loud
+
+    def stats(self):
+        return {
+            "frames": self.frames,
+            "gated": self.gated,
+            "gated_ratio": self.gated / self.frames if self.frames else 0.0,
+        }
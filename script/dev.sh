@@ -14,7 +14,7 @@ fi
 
 # Start ASR module
 echo "Starting ASR module..."
-python ./backend/asr.py &
+python -m backend.asr &
 
 # Give it time to start
 sleep 2
@@ -24,4 +24,4 @@ echo "Starting API server..."
 echo "Host: $HOST, Port: $PORT"
 HOST=${HOST:-0.0.0.0}
 PORT=${PORT:-8000}
-uvicorn backend.tts:app --host "$HOST" --port "$PORT"
\ No newline at end of file
+uvicorn backend.app:app --host "$HOST" --port "$PORT"
\ No newline at end of file